@@ -1,5 +1,156 @@
+"""
+convert questions in Aiken format to a dictionary
+
+the file is read line by line, the questions are yielded one at a time
+
+"""
+
+import logging
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterator
+
+OPTION_PATTERN = re.compile(r"^([A-Z])[.)]\s+(.*)$")
+ANSWER_PATTERN = re.compile(r"^ANSWER:\s*([A-Z])\s*$")
+IMAGE_PATTERN = re.compile(r"^\[Image:\s*(.+?)\s*\]$")
+FEEDBACK_PREFIX = "# Feedback:"
+CATEGORY_PREFIX = "$CATEGORY:"
+# length of the question text used as question name
+NAME_LENGTH = 100
+
+
+def iter_aiken_questions(
+    aiken_file: str, question_types: list, image_files_path: str
+) -> Iterator[tuple[str, dict]]:
+    """
+    Parse an Aiken question file line by line and yield (category, question) one at a time.
+    The questions have the same structure as the multichoice questions of moodle_xml.
+
+    The images ([Image: file name]) are not embedded in the file: they are added to
+    the files of the question and must be uploaded in image_files_path.
+    Malformed questions are skipped and logged.
+    Raises ValueError if the multichoice questions are not allowed.
+    """
+
+    if "multichoice" not in question_types:
+        raise ValueError(
+            "Aiken files contain multichoice questions, not allowed in this course"
+        )
+
+    current_category = "Uncategorized"
+    question_names: dict = defaultdict(set)
+
+    text_lines: list = []
+    files: list = []
+    general_feedback = None
+    answers: list = []
+    letters: list = []
+    start_line = 0
+
+    def reset():
+        nonlocal general_feedback, start_line
+        text_lines.clear()
+        files.clear()
+        answers.clear()
+        letters.clear()
+        general_feedback = None
+        start_line = 0
+
+    with open(aiken_file, "r", encoding="utf-8-sig") as f_in:
+        for line_number, line in enumerate(f_in, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith(CATEGORY_PREFIX):
+                if text_lines:
+                    logging.warning(
+                        f"Aiken line {start_line}: question without answer skipped"
+                    )
+                    reset()
+                category = line.removeprefix(CATEGORY_PREFIX).strip().rstrip("/")
+                current_category = category.split("/")[-1] or "Uncategorized"
+                continue
+
+            if not start_line:
+                start_line = line_number
+
+            if match := IMAGE_PATTERN.match(line):
+                files.append(Path(match.group(1)).name)
+                if not (Path(image_files_path) / files[-1]).is_file():
+                    logging.info(
+                        f"Aiken line {line_number}: image {files[-1]} must be uploaded"
+                    )
+                continue
+
+            if line.startswith(FEEDBACK_PREFIX):
+                feedback = line.removeprefix(FEEDBACK_PREFIX).strip()
+                if answers:
+                    answers[-1]["feedback"] = feedback
+                else:
+                    general_feedback = feedback
+                continue
+
+            if text_lines and (match := ANSWER_PATTERN.match(line)):
+                if match.group(1) not in letters:
+                    logging.warning(
+                        f"Aiken line {line_number}: answer {match.group(1)} not found, question skipped"
+                    )
+                    reset()
+                    continue
+                for letter, answer in zip(letters, answers):
+                    answer["fraction"] = "100" if letter == match.group(1) else "0"
+
+                question_text = "\n".join(text_lines)
+                # if question name already used in topic change it
+                question_name = " ".join(question_text.split())[:NAME_LENGTH]
+                while question_name in question_names[current_category]:
+                    question_name += "_"
+                question_names[current_category].add(question_name)
+
+                yield (
+                    current_category,
+                    {
+                        "type": "multichoice",
+                        "name": question_name,
+                        "questiontext": question_text,
+                        "generalfeedback": general_feedback,
+                        "answers": list(answers),
+                        "feedback": {
+                            "correct": None,
+                            "partiallycorrect": None,
+                            "incorrect": None,
+                        },
+                        "files": list(files),
+                    },
+                )
+                reset()
+                continue
+
+            if text_lines and (match := OPTION_PATTERN.match(line)):
+                letters.append(match.group(1))
+                answers.append(
+                    {"fraction": "0", "text": match.group(2), "feedback": None}
+                )
+                continue
+
+            if answers:
+                # text after the options: the ANSWER line is missing
+                logging.warning(
+                    f"Aiken line {start_line}: question without answer skipped"
+                )
+                reset()
+                start_line = line_number
+
+            text_lines.append(line)
+
+    if text_lines:
+        logging.warning(f"Aiken line {start_line}: question without answer skipped")
+
+
 def aiken_to_dict_with_images(
-    xml_file: str, question_types: list, image_files_path: str
+    aiken_file: str, question_types: list, image_files_path: str
 ) -> dict:
     """
     Convert questions in aiken format to a dictionary
@@ -20,4 +171,19 @@ def aiken_to_dict_with_images(
     ANSWER: B
     """
 
-    pass
+    categories_dict = defaultdict(list)
+    for category, question_dict in iter_aiken_questions(
+        aiken_file, question_types, image_files_path
+    ):
+        categories_dict[category].append(question_dict)
+
+    return dict(sorted(categories_dict.items()))
+
+
+if __name__ == "__main__":
+    import sys
+
+    questions = aiken_to_dict_with_images(sys.argv[1], ["multichoice"], "tmp")
+
+    for category in questions:
+        print(category, len(questions[category]))
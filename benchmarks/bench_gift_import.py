@@ -0,0 +1,69 @@
+"""
+benchmark of GIFT parsing: sequential vs chunked parsing in a process pool
+
+usage:
+    python benchmarks/bench_gift_import.py [number of questions]
+
+a synthetic GIFT file with multichoice, true/false and short answer questions
+in 50 categories is written in a temporary directory
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import gift  # noqa: E402
+
+
+def synthetic_gift(n_questions: int) -> str:
+    """
+    return a GIFT file with n_questions questions in 50 categories
+    """
+    lines: list = []
+    for i in range(n_questions):
+        if i % (n_questions // 50 or 1) == 0:
+            lines.append(f"$CATEGORY: $course$/top/Bench/Topic {i:06d}\n")
+        if i % 3 == 0:
+            lines.append(
+                f"::Question {i}::What is the answer of question {i}? "
+                "{=right answer#good ~wrong answer#no ~other answer#no}\n"
+            )
+        elif i % 3 == 1:
+            lines.append(f"::Question {i}::Question {i} is true. {{T}}\n")
+        else:
+            lines.append(f"::Question {i}::Name of question {i}? {{=answer {i}}}\n")
+    return "\n".join(lines)
+
+
+def count(questions: dict) -> int:
+    return sum(len(names) for types in questions.values() for names in types.values())
+
+
+def main(n_questions: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = Path(tmp_dir) / "bench.gift"
+        file_path.write_text(synthetic_gift(n_questions))
+        print(f"{n_questions} questions, {file_path.stat().st_size / 1e6:.1f} MB")
+
+        results: dict = {}
+        for label, parallel_min_size in (
+            ("sequential", float("inf")),
+            ("chunked", 0),
+        ):
+            gift.PARALLEL_MIN_SIZE = parallel_min_size
+            start = time.perf_counter()
+            results[label] = gift.gift_to_dict(str(file_path), [])
+            elapsed = time.perf_counter() - start
+            n = count(results[label])
+            print(
+                f"{label:12} {n} questions in {elapsed:.2f} s ({n / elapsed:.0f} q/s)"
+            )
+
+        assert results["sequential"] == results["chunked"]
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
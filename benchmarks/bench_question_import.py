@@ -0,0 +1,97 @@
+"""
+benchmark of question import: INSERT loop vs COPY (bulk_load.copy_questions)
+
+usage (from the application directory, with config.py):
+    python benchmarks/bench_question_import.py [number of questions]
+
+the questions are loaded in a temporary course (__bench__) that is deleted at the end
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import text  # noqa: E402
+
+import bulk_load  # noqa: E402
+from db import engine  # noqa: E402
+
+COURSE = "__bench__"
+
+
+def synthetic_questions(n_questions: int):
+    """
+    yield (topic, question) with n_questions multichoice questions in 20 topics
+    """
+    for i in range(n_questions):
+        yield (
+            f"Topic {i % 20:02d}",
+            {
+                "type": "multichoice",
+                "name": f"Question {i}",
+                "questiontext": f"What is the answer of question *{i}*? " * 3,
+                "generalfeedback": "",
+                "answers": [
+                    {
+                        "fraction": "100" if j == 0 else "0",
+                        "text": f"answer {j}",
+                        "feedback": f"feedback for answer {j}",
+                    }
+                    for j in range(4)
+                ],
+                "feedback": {},
+                "files": [],
+            },
+        )
+
+
+def insert_loop(conn, questions) -> int:
+    """
+    previous implementation: one INSERT by question
+    """
+    conn.execute(
+        text("DELETE FROM questions WHERE course = :course"), {"course": COURSE}
+    )
+    n = 0
+    for topic, question in questions:
+        conn.execute(
+            text(
+                "INSERT INTO questions (course, topic, type, name, content) "
+                "VALUES (:course, :topic, :type, :name, :content)"
+            ),
+            {
+                "course": COURSE,
+                "topic": topic,
+                "type": question["type"],
+                "name": question["name"],
+                "content": json.dumps(question),
+            },
+        )
+        n += 1
+    return n
+
+
+def main(n_questions: int) -> None:
+    for label, function in (
+        ("INSERT loop", insert_loop),
+        ("COPY", lambda conn, q: bulk_load.copy_questions(conn, COURSE, q)),
+    ):
+        with engine.connect() as conn:
+            start = time.perf_counter()
+            n = function(conn, synthetic_questions(n_questions))
+            conn.commit()
+            elapsed = time.perf_counter() - start
+        print(f"{label:12} {n} questions in {elapsed:.2f} s ({n / elapsed:.0f} rows/s)")
+
+    with engine.connect() as conn:
+        conn.execute(
+            text("DELETE FROM questions WHERE course = :course"), {"course": COURSE}
+        )
+        conn.commit()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
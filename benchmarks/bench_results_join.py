@@ -0,0 +1,118 @@
+"""
+benchmark of the join of results and questions:
+text join on (course, topic, type, name) vs integer join on question_id
+
+usage (from the application directory, with config.py):
+    python benchmarks/bench_results_join.py [number of results]
+
+the tables are temporary copies (bench_questions, bench_results) filled with
+synthetic data (5M results by default), the queries are timed with EXPLAIN ANALYZE
+"""
+
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import text  # noqa: E402
+
+from db import engine  # noqa: E402
+
+N_QUESTIONS = 5_000
+N_USERS = 2_000
+COURSE = "__bench__"
+
+SETUP = [
+    """CREATE TEMP TABLE bench_questions (
+        id SERIAL PRIMARY KEY, course TEXT, topic TEXT, type TEXT NOT NULL,
+        name TEXT NOT NULL, questiontext TEXT, deleted TIMESTAMP)""",
+    """INSERT INTO bench_questions (course, topic, type, name, questiontext)
+        SELECT :course, 'Topic ' || (i % 20), 'multichoice',
+            'Question name number ' || i, 'What is the answer of question ' || i || '?'
+        FROM generate_series(1, :n_questions) AS i""",
+    """CREATE TEMP TABLE bench_results (
+        id SERIAL PRIMARY KEY, course TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        user_id INTEGER NOT NULL, question_id INTEGER, topic TEXT NOT NULL,
+        question_type TEXT NOT NULL, question_name TEXT NOT NULL, good_answer BOOLEAN NOT NULL)""",
+    """INSERT INTO bench_results (course, user_id, question_id, topic, question_type, question_name, good_answer)
+        SELECT q.course, 1 + (i % :n_users), q.id, q.topic, q.type, q.name, random() < 0.7
+        FROM generate_series(1, :n_results) AS i
+        JOIN bench_questions q ON q.id = 1 + (i * 7919) % :n_questions""",
+    # indexes of the text join (db_schema.sql) and of the integer join (migration 002)
+    "CREATE INDEX ON bench_results (topic)",
+    "CREATE INDEX ON bench_results (user_id)",
+    "CREATE INDEX ON bench_results (user_id, question_id) INCLUDE (good_answer)",
+    "CREATE INDEX ON bench_results (question_id)",
+    "ANALYZE bench_questions",
+    "ANALYZE bench_results",
+]
+
+QUERIES = {
+    "user scores (get_questions_dataframe)": (
+        """SELECT q.id, SUM(CASE WHEN good_answer THEN 1 ELSE 0 END) AS n_ok
+        FROM bench_questions q LEFT JOIN bench_results r
+            ON q.course = r.course AND q.topic = r.topic
+            AND q.type = r.question_type AND q.name = r.question_name
+            AND r.user_id = :user_id
+        WHERE q.course = :course AND q.deleted IS NULL GROUP BY q.id""",
+        """SELECT q.id, SUM(CASE WHEN good_answer THEN 1 ELSE 0 END) AS n_ok
+        FROM bench_questions q LEFT JOIN bench_results r
+            ON r.question_id = q.id AND r.user_id = :user_id
+        WHERE q.course = :course AND q.deleted IS NULL GROUP BY q.id""",
+    ),
+    "most wrong questions (course_management)": (
+        """SELECT q.id, COUNT(*) AS n, AVG(CASE WHEN r.good_answer THEN 1.0 ELSE 0 END) AS rate
+        FROM bench_results r JOIN bench_questions q ON r.question_name = q.name
+        WHERE r.course = :course AND q.course = :course AND q.deleted IS NULL
+        GROUP BY q.id ORDER BY rate LIMIT 100""",
+        """SELECT q.id, COUNT(*) AS n, AVG(CASE WHEN r.good_answer THEN 1.0 ELSE 0 END) AS rate
+        FROM bench_results r JOIN bench_questions q ON r.question_id = q.id
+        WHERE q.course = :course AND q.deleted IS NULL
+        GROUP BY q.id ORDER BY rate LIMIT 100""",
+    ),
+}
+
+
+def explain(conn, query: str, parameters: dict) -> float:
+    """
+    returns the execution time (ms) reported by EXPLAIN ANALYZE
+    """
+    plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {query}"), parameters)
+    for (line,) in plan:
+        if match := re.match(r"Execution Time: ([\d.]+) ms", line):
+            return float(match.group(1))
+    return float("nan")
+
+
+def main(n_results: int) -> None:
+    parameters = {
+        "course": COURSE,
+        "n_questions": N_QUESTIONS,
+        "n_users": N_USERS,
+        "n_results": n_results,
+        "user_id": 1,
+    }
+    with engine.connect() as conn:
+        start = time.perf_counter()
+        for statement in SETUP:
+            conn.execute(text(statement), parameters)
+        print(f"{n_results} results created in {time.perf_counter() - start:.1f} s")
+
+        for label, (text_join, integer_join) in QUERIES.items():
+            # first run to warm the cache
+            explain(conn, text_join, parameters)
+            explain(conn, integer_join, parameters)
+            before = explain(conn, text_join, parameters)
+            after = explain(conn, integer_join, parameters)
+            print(
+                f"{label:42} text join {before:9.1f} ms   "
+                f"question_id {after:9.1f} ms   x{before / after:.1f}"
+            )
+
+        conn.rollback()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000)
@@ -0,0 +1,112 @@
+"""
+benchmark of the course results report (results route) with a growing number of users
+
+usage (from the application directory, with config.py):
+    python benchmarks/bench_results_report.py [answers by user]
+
+a temporary course (__bench__) with 1000 questions is created with 100, 400 and 1600 users,
+the page is requested with the test client; the data are deleted at the end
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import text  # noqa: E402
+
+import bulk_load  # noqa: E402
+import quizzych  # noqa: E402
+import scores  # noqa: E402
+from bench_question_import import synthetic_questions  # noqa: E402
+from db import engine  # noqa: E402
+
+COURSE = "__bench__"
+N_QUESTIONS = 1000
+N_REQUESTS = 5
+
+
+def add_users(conn, first: int, last: int, n_answers: int) -> None:
+    """
+    create the users first..last-1 of the course and their answers
+    """
+    user_ids = conn.execute(
+        text(
+            "INSERT INTO users (nickname, email, password_hash, quizz) "
+            "SELECT :course || i, :course || i || '@example.org', '', ARRAY[:course] "
+            "FROM generate_series(:first, :last - 1) AS i RETURNING id"
+        ),
+        {"course": COURSE, "first": first, "last": last},
+    ).scalars()
+    conn.execute(
+        text(
+            "INSERT INTO results (course, user_id, question_id, topic, question_type, question_name, good_answer) "
+            "SELECT :course, u.id, q.id, q.topic, q.type, q.name, random() < 0.7 "
+            "FROM unnest(CAST(:user_ids AS INTEGER[])) AS u(id) "
+            "CROSS JOIN generate_series(1, :n_answers) AS i "
+            "JOIN LATERAL (SELECT * FROM questions WHERE course = :course "
+            "    OFFSET (u.id * 31 + i * 7) % :n_questions LIMIT 1) q ON TRUE"
+        ),
+        {
+            "course": COURSE,
+            "user_ids": list(user_ids),
+            "n_answers": n_answers,
+            "n_questions": N_QUESTIONS,
+        },
+    )
+
+
+def clean(conn) -> None:
+    for statement in (
+        "DELETE FROM user_question_stats WHERE course = :course",
+        "DELETE FROM results WHERE course = :course",
+        "DELETE FROM users WHERE :course = ANY(quizz)",
+        "DELETE FROM questions WHERE course = :course",
+        "DELETE FROM courses WHERE name = :course",
+    ):
+        conn.execute(text(statement), {"course": COURSE})
+    conn.commit()
+
+
+def main(n_answers: int) -> None:
+    app = quizzych.app
+    app.debug = True  # SQL statistics in the X-SQL-* headers
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["nickname"] = "admin"
+        session["user_id"] = 0
+
+    with engine.connect() as conn:
+        clean(conn)
+        conn.execute(
+            text("INSERT INTO courses (name) VALUES (:course)"), {"course": COURSE}
+        )
+        bulk_load.copy_questions(conn, COURSE, synthetic_questions(N_QUESTIONS))
+        conn.commit()
+
+        n_users = 0
+        try:
+            for target in (100, 400, 1600):
+                add_users(conn, n_users, target, n_answers)
+                scores.rebuild_user_question_stats(conn, COURSE)
+                conn.commit()
+                n_users = target
+
+                for mode in ("mean", "by_topic"):
+                    url = f"{app.config['APPLICATION_ROOT']}/results/{COURSE}/{mode}"
+                    client.get(url)  # warm up
+                    start = time.perf_counter()
+                    for _ in range(N_REQUESTS):
+                        response = client.get(url)
+                    elapsed = (time.perf_counter() - start) / N_REQUESTS
+                    print(
+                        f"{n_users:5} users {mode:9} {elapsed * 1000:8.1f} ms "
+                        f"{response.headers.get('X-SQL-Queries')} queries"
+                    )
+        finally:
+            clean(conn)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,189 @@
+"""
+bulk loading of questions with COPY FROM STDIN
+
+"""
+
+import csv
+import json
+import tempfile
+from typing import Iterable
+
+from sqlalchemy import text
+
+# rows are buffered in memory up to this size, then in a temporary file
+BUFFER_MAX_SIZE = 16 * 1024 * 1024
+
+
+def copy_to_staging(conn, questions: Iterable[tuple[str, dict]]) -> int:
+    """
+    stream questions (iterable of (topic, question dict)) into the temporary table
+    questions_staging with COPY FROM STDIN
+    the table is dropped at the end of the transaction
+
+    returns the number of rows copied
+    """
+    conn.execute(
+        text(
+            "CREATE TEMP TABLE questions_staging ("
+            "position INTEGER, topic TEXT, type TEXT, name TEXT, content JSONB"
+            ") ON COMMIT DROP"
+        )
+    )
+
+    n_rows = 0
+    with tempfile.SpooledTemporaryFile(
+        max_size=BUFFER_MAX_SIZE, mode="w+", newline=""
+    ) as buffer:
+        # None is written as NULL, empty strings stay empty strings
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NOTNULL, lineterminator="\n")
+        for topic, question in questions:
+            writer.writerow(
+                (
+                    n_rows,
+                    topic,
+                    question["type"],
+                    question["name"],
+                    json.dumps(question),
+                )
+            )
+            n_rows += 1
+        buffer.seek(0)
+
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY questions_staging (position, topic, type, name, content) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+    return n_rows
+
+
+def copy_questions(conn, course: str, questions: Iterable[tuple[str, dict]]) -> int:
+    """
+    replace all the questions of course by questions (iterable of (topic, question dict))
+
+    the rows are copied in a staging table and swapped with the current questions
+    of the course in the transaction of conn (the caller must commit)
+
+    returns the number of loaded questions
+    """
+    n_rows = copy_to_staging(conn, questions)
+
+    conn.execute(
+        text("DELETE FROM questions WHERE course = :course"),
+        {"course": course},
+    )
+    conn.execute(
+        text(
+            "INSERT INTO questions (course, topic, type, name, content) "
+            "SELECT :course, topic, type, name, content "
+            "FROM questions_staging ORDER BY position"
+        ),
+        {"course": course},
+    )
+    relink_results(conn, course)
+
+    return n_rows
+
+
+def relink_results(conn, course: str) -> int:
+    """
+    set the question_id of the results of course that are not linked to a question
+    (results of questions deleted by a full import, results recorded before question_id)
+    and of the archived answers (archived_results_stats)
+    the results are matched on (topic, type, name), preferring the not deleted questions
+
+    returns the number of linked rows
+    """
+    return sum(
+        conn.execute(
+            text(
+                f"UPDATE {table} r SET question_id = q.id "
+                "FROM ("
+                "    SELECT DISTINCT ON (topic, type, name) id, topic, type, name "
+                "    FROM questions WHERE course = :course "
+                "    ORDER BY topic, type, name, deleted IS NOT NULL, id"
+                ") q "
+                "WHERE r.course = :course AND r.question_id IS NULL "
+                "AND r.topic = q.topic AND r.question_type = q.type AND r.question_name = q.name"
+            ),
+            {"course": course},
+        ).rowcount
+        for table in ("results", "archived_results_stats")
+    )
+
+
+def merge_questions(
+    conn, course: str, questions: Iterable[tuple[str, dict]]
+) -> dict[str, int]:
+    """
+    incremental import: update the questions of course with questions
+    (iterable of (topic, question dict)) and keep the id of the unchanged questions
+
+    a question is identified by (topic, type, name) and compared on its content:
+    - new questions are inserted
+    - questions with a modified content are updated (and undeleted)
+    - questions that are no longer in the file are set as deleted
+    the changes are made in the transaction of conn (the caller must commit)
+
+    returns the summary of the changes
+    """
+    n_rows = copy_to_staging(conn, questions)
+
+    # existing question matching each new question (lowest id if duplicated)
+    conn.execute(
+        text(
+            "CREATE TEMP TABLE questions_matched ON COMMIT DROP AS "
+            "SELECT s.position, s.topic, s.type, s.name, s.content, e.id AS question_id "
+            "FROM questions_staging s LEFT JOIN ("
+            "    SELECT DISTINCT ON (topic, type, name) id, topic, type, name "
+            "    FROM questions WHERE course = :course "
+            "    ORDER BY topic, type, name, id"
+            ") e ON e.topic = s.topic AND e.type = s.type AND e.name = s.name"
+        ),
+        {"course": course},
+    )
+
+    n_updated = conn.execute(
+        text(
+            "UPDATE questions q SET content = m.content, deleted = NULL "
+            "FROM questions_matched m "
+            "WHERE q.id = m.question_id "
+            "AND (q.content IS DISTINCT FROM m.content OR q.deleted IS NOT NULL)"
+        )
+    ).rowcount
+
+    n_inserted = conn.execute(
+        text(
+            "INSERT INTO questions (course, topic, type, name, content) "
+            "SELECT :course, topic, type, name, content "
+            "FROM questions_matched WHERE question_id IS NULL ORDER BY position"
+        ),
+        {"course": course},
+    ).rowcount
+
+    n_deleted = conn.execute(
+        text(
+            "UPDATE questions SET deleted = NOW() "
+            "WHERE course = :course AND deleted IS NULL "
+            "AND id NOT IN ("
+            "    SELECT question_id FROM questions_matched WHERE question_id IS NOT NULL"
+            ")"
+        ),
+        {"course": course},
+    ).rowcount
+
+    n_relinked = relink_results(conn, course)
+
+    return {
+        "questions": n_rows,
+        "inserted": n_inserted,
+        "updated": n_updated,
+        "deleted": n_deleted,
+        "unchanged": n_rows - n_inserted - n_updated,
+        "relinked": n_relinked,
+    }
@@ -0,0 +1,147 @@
+"""
+in-process caches of Quizzych
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    thread-safe LRU dictionary cache with time-to-live and hit/miss counters
+
+    max_items and max_bytes bound the cache (0: no limit),
+    the size of each value is given by the caller of set
+    """
+
+    def __init__(self, ttl: float = 60, max_items: int = 0, max_bytes: int = 0):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        # key -> (expiration time, size, value)
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def _remove(self, key) -> None:
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def get(self, key, default=None):
+        """
+        return value for key or default if key is missing or expired
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[2]
+
+    def set(self, key, value, size: int = 0) -> None:
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + self.ttl, size, value)
+            self.bytes += size
+            while self._data and (
+                (self.max_items and len(self._data) > self.max_items)
+                or (self.max_bytes and self.bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def invalidate_matching(self, predicate) -> None:
+        """
+        remove all keys for which predicate(key) is true
+        """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        """
+        return counters of cache
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "items": len(self._data),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 3) if total else None,
+            }
+
+
+class SingleFlight:
+    """
+    coalesce concurrent calls: while a computation for a key is running,
+    the other callers for the same key wait for its result instead of computing it again
+    """
+
+    def __init__(self):
+        # key -> (event set when done, [result, exception])
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+        self.calls: int = 0
+        self.coalesced: int = 0
+
+    def do(self, key, function):
+        """
+        return function() or the result of the call of function running for key
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = (threading.Event(), [None, None])
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        event, outcome = call
+        if not leader:
+            event.wait()
+        else:
+            try:
+                outcome[0] = function()
+            except Exception as e:
+                outcome[1] = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                event.set()
+
+        if outcome[1] is not None:
+            raise outcome[1]
+        return outcome[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "running": len(self._calls),
+            }
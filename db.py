@@ -0,0 +1,109 @@
+"""
+database engine shared by Quizzych and the Google auth blueprint
+
+pool parameters are read from config.py:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_PRE_PING, DB_POOL_RECYCLE
+"""
+
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+import config as cfg
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool counting the checkouts waiting for a connection and the time spent waiting
+
+    a checkout waits (waiting, blocked) when no idle connection is available
+    and the overflow is exhausted; the checkout time includes the opening of new connections
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.waiting: int = 0
+        self.blocked: int = 0
+        self.checkouts: int = 0
+        self.timeouts: int = 0
+        self.wait_time: float = 0
+        self.max_wait_time: float = 0
+
+    def _exhausted(self) -> bool:
+        return (
+            self.checkedin() == 0
+            and self._max_overflow > -1
+            and self.overflow() >= self._max_overflow
+        )
+
+    def _do_get(self):
+        blocked = self._exhausted()
+        with self._stats_lock:
+            if blocked:
+                self.waiting += 1
+                self.blocked += 1
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                if blocked:
+                    self.waiting -= 1
+                self.checkouts += 1
+                self.wait_time += elapsed
+                self.max_wait_time = max(self.max_wait_time, elapsed)
+
+    def stats(self) -> dict:
+        """
+        returns the pool statistics
+        """
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": self.overflow(),
+                "waiting": self.waiting,
+                "blocked": self.blocked,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "total_wait_ms": round(self.wait_time * 1000, 1),
+                "mean_wait_ms": round(self.wait_time * 1000 / self.checkouts, 3)
+                if self.checkouts
+                else 0,
+                "max_wait_ms": round(self.max_wait_time * 1000, 1),
+            }
+
+
+def create_db_engine():
+    """
+    create the engine with the pool parameters of config.py
+    """
+    return create_engine(
+        cfg.DATABASE_URL,
+        poolclass=InstrumentedQueuePool,
+        pool_size=getattr(cfg, "DB_POOL_SIZE", 5),
+        max_overflow=getattr(cfg, "DB_MAX_OVERFLOW", 10),
+        pool_timeout=getattr(cfg, "DB_POOL_TIMEOUT", 30),
+        pool_pre_ping=getattr(cfg, "DB_POOL_PRE_PING", True),
+        pool_recycle=getattr(cfg, "DB_POOL_RECYCLE", 1800),
+    )
+
+
+engine = create_db_engine()
+
+
+def pool_stats() -> dict:
+    """
+    returns the statistics of the connection pool of the current process
+    """
+    return engine.pool.stats()
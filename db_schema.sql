@@ -38,7 +38,12 @@ CREATE TABLE questions (
     topic TEXT,
     type TEXT NOT NULL,
     name TEXT NOT NULL,
-    content TEXT NOT NULL
+    content JSONB NOT NULL,
+    questiontext TEXT GENERATED ALWAYS AS (content ->> 'questiontext') STORED,
+    correct_answers JSONB GENERATED ALWAYS AS (
+        jsonb_path_query_array(content, '$.answers[*] ? (@.fraction == "100").text')
+    ) STORED,
+    files JSONB GENERATED ALWAYS AS (COALESCE(content -> 'files', '[]'::jsonb)) STORED
 );
 
 
@@ -65,15 +70,122 @@ CREATE TABLE bookmarks (
     question_id INTEGER NOT NULL
 );
 
+-- partitioned by month (see migrations/007_results_partitioning.sql)
+CREATE SEQUENCE results_id_seq;
+
 CREATE TABLE results (
-    id SERIAL PRIMARY KEY,
+    id INTEGER NOT NULL DEFAULT nextval('results_id_seq'),
     course TEXT,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    nickname TEXT NOT NULL,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    user_id INTEGER NOT NULL,
+    question_id INTEGER REFERENCES questions (id) ON DELETE SET NULL,
     topic TEXT NOT NULL,
     question_type TEXT NOT NULL,
     question_name TEXT NOT NULL,
-    good_answer BOOLEAN NOT NULL
+    good_answer BOOLEAN NOT NULL,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE results_id_seq OWNED BY results.id;
+
+CREATE TABLE results_default PARTITION OF results DEFAULT;
+
+-- the rows of the month are moved out of results_default (see migrations/008_results_default_partition.sql)
+CREATE FUNCTION create_results_partition(month DATE) RETURNS TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    partition_name TEXT := 'results_' || to_char(month, 'YYYY_MM');
+    month_start TIMESTAMP := date_trunc('month', month);
+    month_end TIMESTAMP := date_trunc('month', month) + INTERVAL '1 month';
+    n_moved BIGINT;
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    -- no row inserted in results_default until the partition is created
+    LOCK TABLE results IN ACCESS EXCLUSIVE MODE;
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM results_default WHERE timestamp >= month_start AND timestamp < month_end
+    ) THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF results FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, month_end
+        );
+        RETURN partition_name;
+    END IF;
+
+    -- the statement triggers of results (rollups) are not fired by the move
+    ALTER TABLE results DETACH PARTITION results_default;
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF results FOR VALUES FROM (%L) TO (%L)',
+        partition_name, month_start, month_end
+    );
+    EXECUTE format(
+        'INSERT INTO %I SELECT * FROM results_default WHERE timestamp >= $1 AND timestamp < $2',
+        partition_name
+    ) USING month_start, month_end;
+    GET DIAGNOSTICS n_moved = ROW_COUNT;
+    DELETE FROM results_default WHERE timestamp >= month_start AND timestamp < month_end;
+    ALTER TABLE results ATTACH PARTITION results_default DEFAULT;
+
+    RAISE NOTICE '% rows moved from results_default to %', n_moved, partition_name;
+    RETURN partition_name;
+END;
+$$;
+
+SELECT create_results_partition(CAST(month AS DATE))
+FROM generate_series(
+    date_trunc('month', CURRENT_TIMESTAMP),
+    date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '3 months',
+    INTERVAL '1 month'
+) AS month;
+
+-- answers of the archived partitions of results (see migrations/009_archived_results_stats.sql)
+CREATE TABLE archived_results_stats (
+    month DATE NOT NULL,
+    course TEXT,
+    user_id INTEGER NOT NULL,
+    question_id INTEGER REFERENCES questions (id) ON DELETE SET NULL,
+    topic TEXT NOT NULL,
+    question_type TEXT NOT NULL,
+    question_name TEXT NOT NULL,
+    n_ok INTEGER NOT NULL,
+    n_no INTEGER NOT NULL,
+    last_answer TIMESTAMP
+);
+
+CREATE TABLE user_question_stats (
+    course TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+    n_ok INTEGER NOT NULL DEFAULT 0,
+    n_no INTEGER NOT NULL DEFAULT 0,
+    last_answer TIMESTAMP,
+    PRIMARY KEY (course, user_id, question_id)
+);
+
+-- number of answers of each question (admin excluded) and item analysis
+CREATE TABLE question_stats (
+    question_id INTEGER PRIMARY KEY REFERENCES questions (id) ON DELETE CASCADE,
+    course TEXT NOT NULL,
+    n_answers INTEGER NOT NULL DEFAULT 0,
+    n_ok INTEGER NOT NULL DEFAULT 0,
+    last_answered TIMESTAMP,
+    p_value DOUBLE PRECISION,
+    discrimination DOUBLE PRECISION,
+    analysis_updated TIMESTAMP
+);
+
+CREATE TABLE leaderboard (
+    course TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    score DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (course, user_id)
 );
 
 CREATE TABLE users (
@@ -83,7 +195,102 @@ CREATE TABLE users (
     password_hash TEXT NOT NULL
 );
 
-CREATE INDEX idx_results_nickname ON results(nickname);
 CREATE INDEX idx_results_topic ON results(topic);
 CREATE INDEX idx_questions_topic ON questions(topic);
+CREATE INDEX idx_results_user_question ON results (user_id, question_id) INCLUDE (good_answer);
+CREATE INDEX idx_results_question ON results (question_id);
+CREATE INDEX idx_results_unlinked ON results (course) WHERE question_id IS NULL;
+CREATE INDEX idx_results_course_timestamp ON results (course, timestamp);
+CREATE INDEX idx_user_question_stats_question ON user_question_stats (question_id);
+CREATE INDEX idx_archived_results_stats_course_user ON archived_results_stats (course, user_id);
+CREATE INDEX idx_archived_results_stats_question ON archived_results_stats (question_id);
+CREATE INDEX idx_question_stats_course ON question_stats (course);
+CREATE INDEX idx_leaderboard_rank ON leaderboard (course, score DESC, user_id);
+
+-- number of answers and good answers by hour, topic and question type
+CREATE TABLE course_hourly_stats (
+    course TEXT NOT NULL,
+    hour TIMESTAMP NOT NULL,
+    topic TEXT NOT NULL,
+    question_type TEXT NOT NULL,
+    from_admin BOOLEAN NOT NULL,
+    n_answers INTEGER NOT NULL DEFAULT 0,
+    n_ok INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (course, hour, topic, question_type, from_admin)
+);
+
+-- users (admin excluded) who answered during each hour
+CREATE TABLE course_hourly_users (
+    course TEXT NOT NULL,
+    hour TIMESTAMP NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (course, hour, user_id)
+);
+
+CREATE FUNCTION results_rollup_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO course_hourly_stats (course, hour, topic, question_type, from_admin, n_answers, n_ok)
+    SELECT course, date_trunc('hour', timestamp), topic, question_type, user_id = 0,
+        COUNT(*), COUNT(*) FILTER (WHERE good_answer)
+    FROM new_rows
+    WHERE course IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+    ON CONFLICT (course, hour, topic, question_type, from_admin) DO UPDATE SET
+        n_answers = course_hourly_stats.n_answers + EXCLUDED.n_answers,
+        n_ok = course_hourly_stats.n_ok + EXCLUDED.n_ok;
+
+    INSERT INTO course_hourly_users (course, hour, user_id)
+    SELECT DISTINCT course, date_trunc('hour', timestamp), user_id
+    FROM new_rows
+    WHERE course IS NOT NULL AND user_id <> 0
+    ON CONFLICT DO NOTHING;
+
+    RETURN NULL;
+END;
+$$;
+
+CREATE FUNCTION results_rollup_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE course_hourly_stats s SET
+        n_answers = s.n_answers - o.n_answers,
+        n_ok = s.n_ok - o.n_ok
+    FROM (
+        SELECT course, date_trunc('hour', timestamp) AS hour, topic, question_type,
+            user_id = 0 AS from_admin, COUNT(*) AS n_answers,
+            COUNT(*) FILTER (WHERE good_answer) AS n_ok
+        FROM old_rows
+        WHERE course IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+    ) o
+    WHERE s.course = o.course AND s.hour = o.hour AND s.topic = o.topic
+        AND s.question_type = o.question_type AND s.from_admin = o.from_admin;
+
+    DELETE FROM course_hourly_stats s
+    USING (SELECT DISTINCT course, date_trunc('hour', timestamp) AS hour FROM old_rows) o
+    WHERE s.course = o.course AND s.hour = o.hour AND s.n_answers <= 0;
+
+    -- users without remaining answer during the hour
+    DELETE FROM course_hourly_users u
+    USING (
+        SELECT DISTINCT course, date_trunc('hour', timestamp) AS hour, user_id
+        FROM old_rows
+        WHERE course IS NOT NULL AND user_id <> 0
+    ) o
+    WHERE u.course = o.course AND u.hour = o.hour AND u.user_id = o.user_id
+        AND NOT EXISTS (
+            SELECT 1 FROM results r
+            WHERE r.course = o.course AND r.user_id = o.user_id
+                AND r.timestamp >= o.hour AND r.timestamp < o.hour + INTERVAL '1 hour'
+        );
+
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER results_rollup_insert AFTER INSERT ON results
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION results_rollup_insert();
 
+CREATE TRIGGER results_rollup_delete AFTER DELETE ON results
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION results_rollup_delete();
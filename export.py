@@ -0,0 +1,202 @@
+"""
+export questions in GIFT and Moodle XML formats
+
+the exports are generators of strings: the questions (iterable of (topic, question dict))
+are converted one at a time so that the file can be streamed in the response
+"""
+
+import base64
+import html
+import logging
+import re
+from pathlib import Path
+from typing import Iterable, Iterator
+from xml.sax.saxutils import escape, quoteattr
+
+GIFT_SPECIAL_CHARACTERS = re.compile(r"([~=#{}:\\])")
+# an empty line ends a question in GIFT
+BLANK_LINES = re.compile(r"\n\s*\n")
+
+
+def category_path(course: str, topic: str) -> str:
+    """
+    Moodle category path of a topic
+    """
+    return f"$course$/top/{course}/{topic}"
+
+
+def gift_escape(s) -> str:
+    """
+    escape the GIFT special characters
+    """
+    if s is None:
+        return ""
+    return GIFT_SPECIAL_CHARACTERS.sub(r"\\\1", BLANK_LINES.sub("\n", str(s).strip()))
+
+
+def gift_feedback(answer: dict | None) -> str:
+    if answer is None or not answer.get("feedback"):
+        return ""
+    return f"#{gift_escape(answer['feedback'])}"
+
+
+def question_to_gift(question: dict) -> str:
+    """
+    returns the question in GIFT format (truefalse, multichoice and shortanswer)
+    """
+    answers = question.get("answers", [])
+    lines = [
+        f"::{gift_escape(question['name'])}::{gift_escape(question['questiontext'])}{{"
+    ]
+
+    if question["type"] == "truefalse":
+        right = next((a for a in answers if a.get("fraction") == "100"), None)
+        wrong = next((a for a in answers if a.get("fraction") != "100"), None)
+        value = "F" if right and str(right.get("text", "")).lower() == "false" else "T"
+        feedback = ""
+        if gift_feedback(right) or gift_feedback(wrong):
+            feedback = f"{gift_feedback(wrong) or '#'}{gift_feedback(right) or '#'}"
+        lines.append(f"{value}{feedback}")
+
+    elif question["type"] == "multichoice":
+        for answer in answers:
+            if answer.get("fraction") == "100":
+                prefix = "="
+            elif answer.get("fraction") in (None, "", "0"):
+                prefix = "~"
+            else:
+                prefix = f"~%{answer['fraction']}%"
+            lines.append(
+                f"{prefix}{gift_escape(answer['text'])}{gift_feedback(answer)}"
+            )
+
+    elif question["type"] == "shortanswer":
+        for answer in answers:
+            lines.append(
+                f"=%{answer.get('fraction') or 0}%{gift_escape(answer['text'])}{gift_feedback(answer)}"
+            )
+
+    else:
+        return f"// {question['name']}: {question['type']} questions are not exported in GIFT\n\n"
+
+    if question.get("generalfeedback"):
+        lines.append(f"####{gift_escape(question['generalfeedback'])}")
+    lines.append("}")
+
+    return "\n".join(lines) + "\n\n"
+
+
+def iter_gift(course: str, questions: Iterable[tuple[str, dict]]) -> Iterator[str]:
+    """
+    yield the questions (iterable of (topic, question dict) ordered by topic) in GIFT format
+    """
+    current_topic = None
+    for topic, question in questions:
+        if topic != current_topic:
+            current_topic = topic
+            yield f"$CATEGORY: {category_path(course, topic)}\n\n"
+        yield question_to_gift(question)
+
+
+def xml_text(tag: str, value, indent: str = "    ", attributes: str = "") -> str:
+    """
+    returns <tag><text>value</text></tag> or an empty string if value is None
+    """
+    if value is None:
+        return ""
+    return f"{indent}<{tag}{attributes}>\n{indent}  <text>{escape(str(value))}</text>\n{indent}</{tag}>\n"
+
+
+def question_to_xml(question: dict, image_files_path: str) -> str:
+    """
+    returns the question in Moodle XML format
+    the images of image_files_path are embedded in base64,
+    the external images (http...) are added as <img> tags to the question text,
+    the question text is HTML-escaped (html format) so that the tags are the only markup
+    """
+    files: list = []
+    img_tags: list = []
+    for file_name in question.get("files", []):
+        if file_name.startswith("http"):
+            img_tags.append(f'<img src="{file_name}">')
+            continue
+        file_path = Path(image_files_path) / file_name
+        if not file_path.is_file():
+            logging.warning(f"export: image {file_path} not found")
+            continue
+        img_tags.append(f'<img src="@@PLUGINFILE@@/{file_name}">')
+        files.append(
+            f'      <file name={quoteattr(file_name)} path="/" encoding="base64">'
+            f"{base64.b64encode(file_path.read_bytes()).decode()}</file>\n"
+        )
+
+    question_text = html.escape(question.get("questiontext") or "", quote=False)
+    question_text += "".join(img_tags)
+
+    out = [
+        f"  <question type={quoteattr(question['type'])}>\n",
+        xml_text("name", question["name"]),
+        '    <questiontext format="html">\n',
+        f"      <text>{escape(question_text)}</text>\n",
+        *files,
+        "    </questiontext>\n",
+        xml_text(
+            "generalfeedback",
+            question.get("generalfeedback"),
+            attributes=' format="markdown"',
+        ),
+    ]
+
+    feedback = question.get("feedback") or {}
+    for key in ("correct", "partiallycorrect", "incorrect"):
+        out.append(
+            xml_text(
+                f"{key}feedback", feedback.get(key), attributes=' format="markdown"'
+            )
+        )
+
+    for answer in question.get("answers", []):
+        out.append(
+            f'    <answer fraction={quoteattr(str(answer.get("fraction") or 0))} format="markdown">\n'
+            f"      <text>{escape(str(answer.get('text') or ''))}</text>\n"
+            + xml_text(
+                "feedback",
+                answer.get("feedback"),
+                indent="      ",
+                attributes=' format="markdown"',
+            )
+            + "    </answer>\n"
+        )
+
+    if question["type"] == "multichoice":
+        n_correct = sum(
+            1 for a in question.get("answers", []) if a.get("fraction") == "100"
+        )
+        out.append(f"    <single>{'true' if n_correct <= 1 else 'false'}</single>\n")
+        out.append("    <shuffleanswers>true</shuffleanswers>\n")
+        out.append("    <answernumbering>abc</answernumbering>\n")
+    if question["type"] == "shortanswer":
+        out.append("    <usecase>0</usecase>\n")
+
+    out.append("  </question>\n")
+    return "".join(out)
+
+
+def iter_moodle_xml(
+    course: str, questions: Iterable[tuple[str, dict]], image_files_path: str
+) -> Iterator[str]:
+    """
+    yield the questions (iterable of (topic, question dict) ordered by topic) in Moodle XML format
+    """
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<quiz>\n'
+    current_topic = None
+    for topic, question in questions:
+        if topic != current_topic:
+            current_topic = topic
+            yield (
+                '  <question type="category">\n'
+                f"    <category>\n      <text>{escape(category_path(course, topic))}</text>\n    </category>\n"
+                "  </question>\n"
+            )
+        yield question_to_xml(question, image_files_path)
+    yield "</quiz>\n"
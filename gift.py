@@ -1,10 +1,176 @@
 """
 convert gift questions file in python dictionary
+
+large files are split in chunks on $CATEGORY lines and parsed in a process pool
+(this module must stay without side effects at import: it is imported by the workers)
 """
 
+import logging
+import multiprocessing
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List
+
 import pygiftparser
 from pygiftparser import parser
-from typing import List
+
+# files larger than this size (in characters) are parsed in parallel
+PARALLEL_MIN_SIZE = 1_000_000
+# approximative size of a chunk (in characters)
+CHUNK_SIZE = 250_000
+MAX_WORKERS = 4
+
+# main modules that must not be imported again by the spawned workers
+# (the modules run with python -m are also excluded, see spawn_safe)
+UNSAFE_MAIN_MODULES = ("quizzych",)
+
+# escaped special characters (\~ \= \# \{ \} \: \\)
+ESCAPED_CHARACTER = re.compile(r"\\([~=#{}:\\])")
+# general feedback (####) is parsed by pygiftparser with the feedback of the last answer
+GENERAL_FEEDBACK = re.compile(r"^(.*?)\s*(?<!\\)#{3,4}(.*)$", re.DOTALL)
+FEEDBACK_SEPARATOR = re.compile(r"(?<!\\)#")
+
+
+def unescape(s: str | None) -> str | None:
+    """
+    remove the backslash of the escaped GIFT special characters
+    empty strings are returned as None
+    """
+    if not s:
+        return None
+    return ESCAPED_CHARACTER.sub(r"\1", s).strip() or None
+
+
+def split_gift_chunks(content: str, chunk_size: int = CHUNK_SIZE) -> List[str]:
+    """
+    split GIFT content in chunks starting with a $CATEGORY line
+    consecutive categories are grouped until the chunk reaches chunk_size characters
+    """
+    sections = re.split(r"(?m)^(?=\$CATEGORY:)", content)
+
+    chunks: list = []
+    current: list = []
+    current_size: int = 0
+    for section in sections:
+        if current and current_size + len(section) > chunk_size:
+            chunks.append("".join(current))
+            current, current_size = [], 0
+        current.append(section)
+        current_size += len(section)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def parse_gift_chunk(content: str) -> List[dict]:
+    """
+    parse GIFT content
+    returns a list of questions as dictionaries (with category),
+    type is None for unsupported question types
+    """
+    questions: list = []
+    for question in parser.parse(content).questions:
+        d: dict = {
+            "category": question.category or "",
+            "name": question.name,
+            "questiontext": question.text,
+            "type": None,
+        }
+
+        if isinstance(question.answer, pygiftparser.gift.TrueFalse):
+            d["type"] = "truefalse"
+        if isinstance(question.answer, pygiftparser.gift.Short):
+            d["type"] = "shortanswer"
+        if isinstance(question.answer, pygiftparser.gift.MultipleChoiceRadio):
+            d["type"] = "multichoice"
+
+        if d["type"] is None:
+            questions.append(d)
+            continue
+
+        options = [
+            [option.text, option.percentage, option.feedback]
+            for option in question.answer.options
+        ]
+        d["generalfeedback"] = None
+        if (
+            options
+            and options[-1][2]
+            and (match := GENERAL_FEEDBACK.match(options[-1][2]))
+        ):
+            options[-1][2] = match.group(1)
+            d["generalfeedback"] = unescape(match.group(2))
+
+        if d["type"] == "truefalse":
+            # {T#feedback if wrong#feedback if right}
+            value = options[0][0] == "True"
+            feedback = FEEDBACK_SEPARATOR.split(options[0][2] or "", maxsplit=1)
+            wrong = unescape(feedback[0])
+            right = unescape(feedback[1]) if len(feedback) > 1 else None
+            d["answers"] = [
+                {
+                    "text": "true",
+                    "fraction": "100" if value else "0",
+                    "feedback": right if value else wrong,
+                },
+                {
+                    "text": "false",
+                    "fraction": "0" if value else "100",
+                    "feedback": wrong if value else right,
+                },
+            ]
+        else:
+            d["answers"] = [
+                {
+                    "text": ESCAPED_CHARACTER.sub(r"\1", text),
+                    "fraction": str(int(100 * percentage)),
+                    "feedback": unescape(feedback),
+                }
+                for text, percentage, feedback in options
+            ]
+
+        questions.append(d)
+
+    return questions
+
+
+def spawn_safe() -> bool:
+    """
+    True if the __main__ module can be imported by spawned workers without side effects
+    (the spawned processes import __main__ again, e.g. quizzych would set up the app
+    and its database engine in each worker)
+    """
+    main = sys.modules.get("__main__")
+    spec = getattr(main, "__spec__", None)
+    if spec is not None and spec.name.endswith("__main__"):
+        # python -m package: the code of package/__main__.py is not guarded
+        return False
+    main_file = getattr(main, "__file__", None)
+    return main_file is None or Path(main_file).stem not in UNSAFE_MAIN_MODULES
+
+
+def parse_gift(content: str) -> List[dict]:
+    """
+    parse GIFT content, in parallel for large content
+    (sequentially if the workers cannot be spawned safely, see spawn_safe)
+    the order of the questions is the order of the file
+    """
+    chunks = split_gift_chunks(content)
+    if len(content) < PARALLEL_MIN_SIZE or len(chunks) == 1 or not spawn_safe():
+        return parse_gift_chunk(content)
+
+    # spawn: do not fork the (multi-threaded) web worker
+    with ProcessPoolExecutor(
+        max_workers=min(MAX_WORKERS, len(chunks)),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        return [
+            question
+            for chunk_questions in executor.map(parse_gift_chunk, chunks)
+            for question in chunk_questions
+        ]
 
 
 def gift_to_dict(file_path: str, question_types: list):
@@ -33,68 +199,41 @@ def gift_to_dict(file_path: str, question_types: list):
     with open(file_path, "r") as f_in:
         content = f_in.read()
 
-    g = parser.parse(content)
+    parsed_questions = parse_gift(content)
 
     questions: dict = {}
 
     # check categories
     topic_list: list = []
-    for question in g.questions:
-        if question.category.split("/") not in topic_list:
-            topic_list.append(question.category.split("/"))
+    for question in parsed_questions:
+        if question["category"].split("/") not in topic_list:
+            topic_list.append(question["category"].split("/"))
 
     # remove 2 first categories ("$course$/top/Default ..." ...)
-    print(f"{topic_list=}")
     all_categories = remove_two_shortest(topic_list)
-    print(all_categories)
 
     prefix_to_remove = find_common_prefix(all_categories)
-    print(f"{prefix_to_remove=}")
-
-    c = 0
-    for question in g.questions:
-        c += 1
-        d: dict = {}
-
-        topic: str = question.category.removeprefix(prefix_to_remove)
-
-        d["name"] = question.name
-        d["questiontext"] = question.text
-
-        if isinstance(question.answer, pygiftparser.gift.TrueFalse):
-            d["type"] = "truefalse"
-        if isinstance(question.answer, pygiftparser.gift.Short):
-            d["type"] = "shortanswer"
-        if isinstance(question.answer, pygiftparser.gift.MultipleChoiceRadio):
-            d["type"] = "multichoice"
+    logging.debug(f"{prefix_to_remove=}")
 
-        answers = []
+    n_skipped = 0
+    for question in parsed_questions:
+        if question["type"] is None:
+            n_skipped += 1
+            continue
 
-        for answer in question.answer.options:
-            answers.append(
-                {
-                    "text": answer.text,
-                    "fraction": str(int(100 * answer.percentage)),
-                    "feedback": answer.feedback,
-                }
-            )
-
-        d["answers"] = list(answers)
+        topic: str = question.pop("category").removeprefix(prefix_to_remove)
 
         if topic not in questions:
             questions[topic] = {}
-        if d["type"] not in questions[topic]:
-            questions[topic][d["type"]] = {}
-
-        questions[topic][d["type"]][d["name"]] = dict(d)
-
-        print()
-        print(questions[topic][d["type"]][d["name"]])
+        if question["type"] not in questions[topic]:
+            questions[topic][question["type"]] = {}
 
-        print("-" * 20)
+        questions[topic][question["type"]][question["name"]] = question
 
-    # print(q)
-    print(c)
+    logging.info(
+        f"GIFT {file_path}: {len(parsed_questions)} questions parsed, "
+        f"{len(topic_list)} categories, {n_skipped} questions of unsupported type"
+    )
 
     return questions
 
@@ -2,15 +2,14 @@ from flask import request, redirect, url_for, flash, session, Blueprint
 from requests_oauthlib import OAuth2Session
 import json
 import os
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from pathlib import Path
 
 import config as cfg
+from db import engine
 
 bp = Blueprint("google_auth", __name__)
 
-engine = create_engine(cfg.DATABASE_URL)
-
 # Carico le credenziali dal JSON
 if Path("client_secret.json").is_file():
     try:
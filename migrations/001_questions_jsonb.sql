@@ -0,0 +1,19 @@
+-- questions.content: TEXT (serialized JSON) -> JSONB
+-- generated columns for the fields read by the routes and the dashboard
+-- (requires PostgreSQL >= 12)
+
+BEGIN;
+
+ALTER TABLE questions ALTER COLUMN content TYPE JSONB USING content::jsonb;
+
+ALTER TABLE questions
+    ADD COLUMN questiontext TEXT
+        GENERATED ALWAYS AS (content ->> 'questiontext') STORED,
+    ADD COLUMN correct_answers JSONB
+        GENERATED ALWAYS AS (
+            jsonb_path_query_array(content, '$.answers[*] ? (@.fraction == "100").text')
+        ) STORED,
+    ADD COLUMN files JSONB
+        GENERATED ALWAYS AS (COALESCE(content -> 'files', '[]'::jsonb)) STORED;
+
+COMMIT;
@@ -0,0 +1,33 @@
+-- results.question_id: integer link to the answered question
+-- replaces the join of results and questions on (course, topic, type, name)
+--
+-- the results of questions removed by a full import are set to NULL and linked
+-- again after the import (bulk_load.relink_results)
+
+BEGIN;
+
+ALTER TABLE results
+    ADD COLUMN question_id INTEGER REFERENCES questions (id) ON DELETE SET NULL;
+
+-- backfill (the not deleted question is preferred when a name is duplicated)
+UPDATE results r SET question_id = q.id
+FROM (
+    SELECT DISTINCT ON (course, topic, type, name) id, course, topic, type, name
+    FROM questions
+    ORDER BY course, topic, type, name, deleted IS NOT NULL, id
+) q
+WHERE r.course = q.course
+    AND r.topic = q.topic
+    AND r.question_type = q.type
+    AND r.question_name = q.name;
+
+-- scores of a user (get_questions_dataframe, get_score)
+CREATE INDEX idx_results_user_question ON results (user_id, question_id) INCLUDE (good_answer);
+-- answers to a question (check_answer, course_management) and ON DELETE SET NULL
+CREATE INDEX idx_results_question ON results (question_id);
+-- results to link again after an import
+CREATE INDEX idx_results_unlinked ON results (course) WHERE question_id IS NULL;
+
+COMMIT;
+
+ANALYZE results;
@@ -0,0 +1,28 @@
+-- user_question_stats: number of good and wrong answers of each user to each question
+-- updated by scores.record_results with the results,
+-- rebuilt with: flask --app quizzych rebuild-question-stats
+
+BEGIN;
+
+CREATE TABLE user_question_stats (
+    course TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+    n_ok INTEGER NOT NULL DEFAULT 0,
+    n_no INTEGER NOT NULL DEFAULT 0,
+    last_answer TIMESTAMP,
+    PRIMARY KEY (course, user_id, question_id)
+);
+
+CREATE INDEX idx_user_question_stats_question ON user_question_stats (question_id);
+
+INSERT INTO user_question_stats (course, user_id, question_id, n_ok, n_no, last_answer)
+SELECT course, user_id, question_id,
+    COUNT(*) FILTER (WHERE good_answer),
+    COUNT(*) FILTER (WHERE NOT good_answer),
+    MAX(timestamp)
+FROM results
+WHERE question_id IS NOT NULL
+GROUP BY course, user_id, question_id;
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- leaderboard: score of each user of a course (mean of the topic scores)
+-- updated by check_answer, rebuilt with: flask --app quizzych rebuild-leaderboard
+
+BEGIN;
+
+CREATE TABLE leaderboard (
+    course TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    score DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (course, user_id)
+);
+
+-- rank and neighbours of a user
+CREATE INDEX idx_leaderboard_rank ON leaderboard (course, score DESC, user_id);
+
+COMMIT;
@@ -0,0 +1,108 @@
+-- hourly rollups of the results of each course for the course_management dashboard
+-- maintained by statement-level triggers on results (insert and delete),
+-- rebuilt with: flask --app quizzych rebuild-course-rollups
+-- (results are never updated, except question_id which is not rolled up)
+
+BEGIN;
+
+-- number of answers and good answers by hour, topic and question type
+CREATE TABLE course_hourly_stats (
+    course TEXT NOT NULL,
+    hour TIMESTAMP NOT NULL,
+    topic TEXT NOT NULL,
+    question_type TEXT NOT NULL,
+    from_admin BOOLEAN NOT NULL,
+    n_answers INTEGER NOT NULL DEFAULT 0,
+    n_ok INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (course, hour, topic, question_type, from_admin)
+);
+
+-- users (admin excluded) who answered during each hour
+CREATE TABLE course_hourly_users (
+    course TEXT NOT NULL,
+    hour TIMESTAMP NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (course, hour, user_id)
+);
+
+CREATE FUNCTION results_rollup_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO course_hourly_stats (course, hour, topic, question_type, from_admin, n_answers, n_ok)
+    SELECT course, date_trunc('hour', timestamp), topic, question_type, user_id = 0,
+        COUNT(*), COUNT(*) FILTER (WHERE good_answer)
+    FROM new_rows
+    WHERE course IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+    ON CONFLICT (course, hour, topic, question_type, from_admin) DO UPDATE SET
+        n_answers = course_hourly_stats.n_answers + EXCLUDED.n_answers,
+        n_ok = course_hourly_stats.n_ok + EXCLUDED.n_ok;
+
+    INSERT INTO course_hourly_users (course, hour, user_id)
+    SELECT DISTINCT course, date_trunc('hour', timestamp), user_id
+    FROM new_rows
+    WHERE course IS NOT NULL AND user_id <> 0
+    ON CONFLICT DO NOTHING;
+
+    RETURN NULL;
+END;
+$$;
+
+CREATE FUNCTION results_rollup_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE course_hourly_stats s SET
+        n_answers = s.n_answers - o.n_answers,
+        n_ok = s.n_ok - o.n_ok
+    FROM (
+        SELECT course, date_trunc('hour', timestamp) AS hour, topic, question_type,
+            user_id = 0 AS from_admin, COUNT(*) AS n_answers,
+            COUNT(*) FILTER (WHERE good_answer) AS n_ok
+        FROM old_rows
+        WHERE course IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+    ) o
+    WHERE s.course = o.course AND s.hour = o.hour AND s.topic = o.topic
+        AND s.question_type = o.question_type AND s.from_admin = o.from_admin;
+
+    DELETE FROM course_hourly_stats s
+    USING (SELECT DISTINCT course, date_trunc('hour', timestamp) AS hour FROM old_rows) o
+    WHERE s.course = o.course AND s.hour = o.hour AND s.n_answers <= 0;
+
+    -- users without remaining answer during the hour
+    DELETE FROM course_hourly_users u
+    USING (
+        SELECT DISTINCT course, date_trunc('hour', timestamp) AS hour, user_id
+        FROM old_rows
+        WHERE course IS NOT NULL AND user_id <> 0
+    ) o
+    WHERE u.course = o.course AND u.hour = o.hour AND u.user_id = o.user_id
+        AND NOT EXISTS (
+            SELECT 1 FROM results r
+            WHERE r.course = o.course AND r.user_id = o.user_id
+                AND r.timestamp >= o.hour AND r.timestamp < o.hour + INTERVAL '1 hour'
+        );
+
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER results_rollup_insert AFTER INSERT ON results
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION results_rollup_insert();
+
+CREATE TRIGGER results_rollup_delete AFTER DELETE ON results
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION results_rollup_delete();
+
+INSERT INTO course_hourly_stats (course, hour, topic, question_type, from_admin, n_answers, n_ok)
+SELECT course, date_trunc('hour', timestamp), topic, question_type, user_id = 0,
+    COUNT(*), COUNT(*) FILTER (WHERE good_answer)
+FROM results
+WHERE course IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5;
+
+INSERT INTO course_hourly_users (course, hour, user_id)
+SELECT DISTINCT course, date_trunc('hour', timestamp), user_id
+FROM results
+WHERE course IS NOT NULL AND user_id <> 0;
+
+COMMIT;
@@ -0,0 +1,27 @@
+-- question_stats: number of answers and good answers of each question (admin excluded)
+-- updated by scores.record_results with the results,
+-- p_value and discrimination (item analysis) are written by:
+--     flask --app quizzych refresh-item-analysis
+
+BEGIN;
+
+CREATE TABLE question_stats (
+    question_id INTEGER PRIMARY KEY REFERENCES questions (id) ON DELETE CASCADE,
+    course TEXT NOT NULL,
+    n_answers INTEGER NOT NULL DEFAULT 0,
+    n_ok INTEGER NOT NULL DEFAULT 0,
+    last_answered TIMESTAMP,
+    p_value DOUBLE PRECISION,
+    discrimination DOUBLE PRECISION,
+    analysis_updated TIMESTAMP
+);
+
+CREATE INDEX idx_question_stats_course ON question_stats (course);
+
+INSERT INTO question_stats (question_id, course, n_answers, n_ok, last_answered)
+SELECT question_id, MIN(course), COUNT(*), COUNT(*) FILTER (WHERE good_answer), MAX(timestamp)
+FROM results
+WHERE question_id IS NOT NULL AND user_id <> 0
+GROUP BY question_id;
+
+COMMIT;
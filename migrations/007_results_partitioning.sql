@@ -0,0 +1,86 @@
+-- results partitioned by month on timestamp
+-- queries with a condition on timestamp only scan the matching partitions,
+-- old partitions are archived (gzipped CSV) and dropped with:
+--     flask --app quizzych archive-results
+-- partitions of the next months are created with:
+--     flask --app quizzych create-results-partitions
+-- (rows outside the existing partitions go to results_default)
+
+BEGIN;
+
+LOCK TABLE results IN ACCESS EXCLUSIVE MODE;
+
+DROP TRIGGER results_rollup_insert ON results;
+DROP TRIGGER results_rollup_delete ON results;
+
+ALTER TABLE results RENAME TO results_unpartitioned;
+ALTER TABLE results_unpartitioned RENAME CONSTRAINT results_pkey TO results_unpartitioned_pkey;
+ALTER SEQUENCE results_id_seq OWNED BY NONE;
+
+-- the primary key of a partitioned table must include the partition key
+CREATE TABLE results (
+    id INTEGER NOT NULL DEFAULT nextval('results_id_seq'),
+    course TEXT,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    user_id INTEGER NOT NULL,
+    question_id INTEGER REFERENCES questions (id) ON DELETE SET NULL,
+    topic TEXT NOT NULL,
+    question_type TEXT NOT NULL,
+    question_name TEXT NOT NULL,
+    good_answer BOOLEAN NOT NULL,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE results_id_seq OWNED BY results.id;
+
+CREATE FUNCTION create_results_partition(month DATE) RETURNS TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    partition_name TEXT := 'results_' || to_char(month, 'YYYY_MM');
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF results FOR VALUES FROM (%L) TO (%L)',
+        partition_name,
+        date_trunc('month', month),
+        date_trunc('month', month) + INTERVAL '1 month'
+    );
+    RETURN partition_name;
+END;
+$$;
+
+-- partitions of the months of the existing results and of the next 3 months
+SELECT create_results_partition(CAST(month AS DATE))
+FROM generate_series(
+    date_trunc('month', LEAST(
+        (SELECT MIN(timestamp) FROM results_unpartitioned), CURRENT_TIMESTAMP
+    )),
+    date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '3 months',
+    INTERVAL '1 month'
+) AS month;
+
+CREATE TABLE results_default PARTITION OF results DEFAULT;
+
+-- the rollups are already computed: copy before creating the triggers
+INSERT INTO results (id, course, timestamp, user_id, question_id, topic, question_type, question_name, good_answer)
+SELECT id, course, COALESCE(timestamp, CURRENT_TIMESTAMP), user_id, question_id, topic, question_type, question_name, good_answer
+FROM results_unpartitioned;
+
+DROP TABLE results_unpartitioned;
+
+-- indexes are created on every partition
+CREATE INDEX idx_results_topic ON results (topic);
+CREATE INDEX idx_results_user_question ON results (user_id, question_id) INCLUDE (good_answer);
+CREATE INDEX idx_results_question ON results (question_id);
+CREATE INDEX idx_results_unlinked ON results (course) WHERE question_id IS NULL;
+CREATE INDEX idx_results_course_timestamp ON results (course, timestamp);
+
+CREATE TRIGGER results_rollup_insert AFTER INSERT ON results
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION results_rollup_insert();
+
+CREATE TRIGGER results_rollup_delete AFTER DELETE ON results
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION results_rollup_delete();
+
+COMMIT;
+
+ANALYZE results;
@@ -0,0 +1,57 @@
+-- create_results_partition moves the rows of the month out of results_default:
+-- a partition cannot be created for the months of rows in the default partition
+-- ("updated partition constraint for default partition would be violated"),
+-- the default partition is detached while the rows are moved
+-- the months of the rows of results_default are created by:
+--     flask --app quizzych create-results-partitions
+--     flask --app quizzych archive-results
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION create_results_partition(month DATE) RETURNS TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    partition_name TEXT := 'results_' || to_char(month, 'YYYY_MM');
+    month_start TIMESTAMP := date_trunc('month', month);
+    month_end TIMESTAMP := date_trunc('month', month) + INTERVAL '1 month';
+    n_moved BIGINT;
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    -- no row inserted in results_default until the partition is created
+    LOCK TABLE results IN ACCESS EXCLUSIVE MODE;
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM results_default WHERE timestamp >= month_start AND timestamp < month_end
+    ) THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF results FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, month_end
+        );
+        RETURN partition_name;
+    END IF;
+
+    -- the statement triggers of results (rollups) are not fired by the move
+    ALTER TABLE results DETACH PARTITION results_default;
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF results FOR VALUES FROM (%L) TO (%L)',
+        partition_name, month_start, month_end
+    );
+    EXECUTE format(
+        'INSERT INTO %I SELECT * FROM results_default WHERE timestamp >= $1 AND timestamp < $2',
+        partition_name
+    ) USING month_start, month_end;
+    GET DIAGNOSTICS n_moved = ROW_COUNT;
+    DELETE FROM results_default WHERE timestamp >= month_start AND timestamp < month_end;
+    ALTER TABLE results ATTACH PARTITION results_default DEFAULT;
+
+    RAISE NOTICE '% rows moved from results_default to %', n_moved, partition_name;
+    RETURN partition_name;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,26 @@
+-- archived_results_stats: number of good and wrong answers of the archived partitions
+-- of results by month, course, user and question, written by archive-results
+-- before a partition is dropped
+-- the rebuilds of user_question_stats, question_stats and the leaderboard add them
+-- to the remaining results, the rebuild of the hourly rollups keeps the archived months
+-- (the question is identified as in results: question_id and (topic, question_type, question_name))
+
+BEGIN;
+
+CREATE TABLE archived_results_stats (
+    month DATE NOT NULL,
+    course TEXT,
+    user_id INTEGER NOT NULL,
+    question_id INTEGER REFERENCES questions (id) ON DELETE SET NULL,
+    topic TEXT NOT NULL,
+    question_type TEXT NOT NULL,
+    question_name TEXT NOT NULL,
+    n_ok INTEGER NOT NULL,
+    n_no INTEGER NOT NULL,
+    last_answer TIMESTAMP
+);
+
+CREATE INDEX idx_archived_results_stats_course_user ON archived_results_stats (course, user_id);
+CREATE INDEX idx_archived_results_stats_question ON archived_results_stats (question_id);
+
+COMMIT;
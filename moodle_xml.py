@@ -3,6 +3,7 @@ convert questions from a moodle xml file to a dictionary
 
 """
 
+import html
 import re
 from pathlib import Path
 import xml.etree.ElementTree as ET
@@ -10,98 +11,139 @@ import base64
 from collections import defaultdict
 import logging
 
-from typing import List
+from typing import Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import shutil
 
+# images are decoded and written by a thread pool
+IMAGE_WORKERS = 4
+MAX_PENDING_IMAGES = 64
 
-def moodle_xml_to_dict_with_images(
-    xml_file: str, question_types: list, image_files_path: str
-) -> dict:
+
+def strip_html_tags(text: str) -> str:
     """
-    Convert a Moodle XML question file into a Python dictionary, organizing questions by categories and decoding images from base64.
+    remove HTML tags if text is string else retursn empty string
+    """
+    if text is None:
+        return ""
+    text = text.translate({10: 20, 13: 20})
+    # &nbsp;
+    text = text.replace("&nbsp;", " ")
 
-    Args:
-        xml_file (str): Path to the XML file.
+    clean = re.compile("<.*?>")
+    return re.sub(clean, "", text)
 
-    Returns:
-        dict: A dictionary with categories as keys and lists of questions as values.
+
+def image_file_name(file_name: str, base64_content: str) -> str:
+    """
+    returns the content-addressed name of an embedded image:
+    hash of the base64 content with the extension of the original file name
     """
+    digest = hashlib.sha256("".join(base64_content.split()).encode()).hexdigest()
+    return f"{digest[:32]}{Path(file_name).suffix.lower()}"
 
-    FILES_PATH = image_files_path
 
-    def strip_html_tags(text: str) -> str:
-        """
-        remove HTML tags if text is string else retursn empty string
-        """
-        if text is None:
-            return ""
-        text = text.translate({10: 20, 13: 20})
-        # &nbsp;
-        text = text.replace("&nbsp;", " ")
+def copy_image_areas(files_path: str, original_name: str, file_name: str) -> None:
+    """
+    copy the areas of an image (geojson file <image name>.json of the click-on-image questions)
+    saved under its original name to its content-addressed name
+    """
+    original_areas = Path(files_path) / f"{Path(original_name).name}.json"
+    areas = Path(files_path) / f"{file_name}.json"
+    if original_areas.is_file() and not areas.is_file():
+        shutil.copyfile(original_areas, areas)
+
 
-        clean = re.compile("<.*?>")
-        return re.sub(clean, "", text)
+def save_base64_file(file_path: Path, base64_content: str) -> None:
+    """
+    decode base64 content and write it in file_path
+    the file is renamed at the end so that a partial file is never left with the final name
+    """
+    tmp_path = file_path.with_name(f".{file_path.name}.tmp")
+    with open(tmp_path, "wb") as file_out:
+        file_out.write(base64.b64decode(base64_content))
+    tmp_path.replace(file_path)
 
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
 
-    # check categories
-    unique_categories: list = []
+def iter_question_elements(xml_file: str) -> Iterator[ET.Element]:
+    """
+    yield the <question> elements of a Moodle XML file one at a time
+    each element is cleared after use, so the memory does not grow with the file size
+    """
+    root = None
+    for event, element in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            continue
+        if element.tag == "question":
+            yield element
+            # remove the processed question(s) from the tree
+            root.clear()
+
+
+def category_start_level(xml_file: str) -> int:
+    """
+    returns the first level of the category paths with more than one element
+    (the levels before are common to all categories: $course$/top/...)
+    """
     max_element_len: int = 0
-    elements: dict = {}
-    for question in root.findall("question"):
-        question_type = question.get("type")
-
-        if question_type == "category":
-            category_text = question.find("category/text").text
-            category_elements = category_text.split("/")
+    elements: dict = defaultdict(set)
+    for question in iter_question_elements(xml_file):
+        if question.get("type") == "category":
+            category_elements = question.find("category/text").text.split("/")
             max_element_len = max(max_element_len, len(category_elements))
             for idx, element in enumerate(category_elements):
-                if idx not in elements:
-                    elements[idx] = set()
                 elements[idx].add(element)
 
-            if category_elements not in unique_categories:
-                unique_categories.append(category_elements)
-
     logging.debug(f"{elements=}")
     logging.debug(f"{max_element_len=}")
 
-    print(elements)
-    print(max_element_len)
-
-    start: int | None = None
     for idx in range(max_element_len):
         if len(elements[idx]) > 1:
-            start = idx
-            break
-    logging.debug(f"starting element: {start}")
+            return idx
+    # only one category: use its last element
+    return max(max_element_len - 1, 0)
 
-    unique_categories = elements[start]
-    logging.debug(f"{unique_categories=}")
 
-    # Dictionary to hold questions organized by category
-    categories_dict = defaultdict(list)
+def iter_moodle_xml_questions(
+    xml_file: str, question_types: list, image_files_path: str
+) -> Iterator[tuple[str, dict]]:
+    """
+    Parse a Moodle XML question file with iterparse and yield (category, question) one at a time.
+    Images embedded in base64 are decoded in image_files_path by a thread pool.
+    The images are named by the hash of their content (see image_file_name):
+    identical images are written once and images already on disk are skipped.
+    The areas saved for the original image name are copied (see copy_image_areas).
+
+    The file is read twice: a first streaming pass resolves the categories,
+    the second one yields the questions.
+    """
+
+    FILES_PATH = image_files_path
+
+    start = category_start_level(xml_file)
+    logging.debug(f"starting element: {start}")
+
     current_category = "Uncategorized"
+    question_names: dict = defaultdict(set)
+    saved_files: set = set()
+    pending: set = set()
 
-    question_names: dict = {}
-    errors: list = []
-    # Parse the XML tree
-    for question in root.findall("question"):
-        question_type = question.get("type")
-
-        # Handle category change
-        if question_type == "category":
-            category_text = question.find("category/text").text
-            category_elements = category_text.split("/")
-            if len(category_elements) < start + 1:
-                continue
+    with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as executor:
+        for question in iter_question_elements(xml_file):
+            question_type = question.get("type")
 
-            current_category = category_elements[start]
-            if current_category not in question_names:
-                question_names[current_category] = []
+            # Handle category change
+            if question_type == "category":
+                category_elements = question.find("category/text").text.split("/")
+                if len(category_elements) < start + 1:
+                    continue
+
+                current_category = category_elements[start]
+                continue
 
-        # Handle actual questions
-        else:
             # check if question type is allowed
             if question_type not in question_types:
                 continue
@@ -116,8 +158,9 @@ def moodle_xml_to_dict_with_images(
                 question_name += "_"
 
             question_text = question.find("questiontext/text").text
+            question_text_format = question.find("questiontext").get("format")
 
-            question_names[current_category].append(question_name)
+            question_names[current_category].add(question_name)
 
             question_dict = {
                 "type": question_type,
@@ -131,9 +174,15 @@ def moodle_xml_to_dict_with_images(
                 "files": [],  # To store files related to the question
             }
 
+            # the entities of HTML text (&lt; ...) are decoded after removing the tags
+            if question_text_format == "html":
+                question_dict["questiontext"] = html.unescape(
+                    question_dict["questiontext"]
+                )
+
             # check if external image(s)
             if question_text is not None and '<img src="http' in question_text:
-                img_tag_pattern = r'<img[^>]*src=["\']([^"\']+)["\'][^>]*>'
+                img_tag_pattern = r'<img[^>]*src=["\'](http[^"\']+)["\'][^>]*>'
                 img_sources = re.findall(img_tag_pattern, question_text)
                 for img_source in img_sources:
                     question_dict["files"].append(img_source)
@@ -178,32 +227,61 @@ def moodle_xml_to_dict_with_images(
             # Process embedded files (decode base64 encoded content)
             file_list = question.findall("questiontext/file")
             for file_ in file_list:
-                # print(f"{file_.get("name")=}")
-                # print(f"{file_.text=}")
-                # print()
+                file_name = image_file_name(file_.get("name"), file_.text)
+                question_dict["files"].append(file_name)
+
+                # each image is written once
+                if file_name in saved_files:
+                    continue
+                saved_files.add(file_name)
+                copy_image_areas(FILES_PATH, file_.get("name"), file_name)
+                if (Path(FILES_PATH) / file_name).is_file():
+                    continue
 
-                # save base64 str into file
                 if not Path(FILES_PATH).is_dir():
                     Path(FILES_PATH).mkdir(parents=True, exist_ok=True)
-                with open(Path(FILES_PATH) / Path(file_.get("name")), "wb") as file_out:
-                    file_out.write(base64.b64decode(file_.text))
+                pending.add(
+                    executor.submit(
+                        save_base64_file, Path(FILES_PATH) / file_name, file_.text
+                    )
+                )
+                if len(pending) >= MAX_PENDING_IMAGES:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+
+            yield current_category, question_dict
 
-                question_dict["files"].append(file_.get("name"))
+        for future in pending:
+            future.result()
 
-            # Add the question to the respective category
-            if current_category not in categories_dict:
-                categories_dict[current_category] = []
-            categories_dict[current_category].append(question_dict)
+
+def moodle_xml_to_dict_with_images(
+    xml_file: str, question_types: list, image_files_path: str
+) -> dict:
+    """
+    Convert a Moodle XML question file into a Python dictionary, organizing questions by categories and decoding images from base64.
+
+    Args:
+        xml_file (str): Path to the XML file.
+
+    Returns:
+        dict: A dictionary with categories as keys and lists of questions as values.
+    """
+
+    # Dictionary to hold questions organized by category
+    categories_dict = defaultdict(list)
+    for category, question_dict in iter_moodle_xml_questions(
+        xml_file, question_types, image_files_path
+    ):
+        categories_dict[category].append(question_dict)
 
     # sort categories
     categories_dict = dict(sorted(categories_dict.items()))
 
     logging.debug(f"{categories_dict.keys()=}")
 
-    if errors:
-        return {"error": errors}
-
-    return dict(categories_dict)
+    return categories_dict
 
 
 if __name__ == "__main__":
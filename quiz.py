@@ -319,3 +319,57 @@ f_rnd = 0.15  # deviazione standard della normale usata nel random walk
 f_student_score = 1.1  # fattore di moltiplicazione dello score dello studente. se maggiore di 1 le domande selezionate
 # hanno un livello di difficoltà superiore allo score medio dello studente
 # (e.g livello medio di difficoltà = f_studente_score * studente_score)
+
+
+def item_analysis(
+    user_ids: np.ndarray, question_ids: np.ndarray, success_rates: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    classical item analysis of a set of questions (e.g. a topic)
+
+    Args:
+
+        user_ids (np.ndarray): user of each (user, question) pair
+        question_ids (np.ndarray): question of each (user, question) pair
+        success_rates (np.ndarray): proportion of good answers of the user to the question
+
+    Returns:
+
+        question ids, p-values (mean success rate of the users who answered the question)
+        and discrimination indexes (correlation between the success rate to the question
+        and the mean success rate of the user to the other questions, NaN if not computable)
+    """
+
+    users, user_idx = np.unique(user_ids, return_inverse=True)
+    questions, question_idx = np.unique(question_ids, return_inverse=True)
+
+    # users x questions matrix (NaN if not answered)
+    x = np.full((len(users), len(questions)), np.nan)
+    x[user_idx, question_idx] = success_rates
+    answered = ~np.isnan(x)
+    x0 = np.where(answered, x, 0.0)
+
+    n_by_question = answered.sum(axis=0)
+    p_values = x0.sum(axis=0) / n_by_question
+
+    # mean success rate of each user to the other questions
+    n_by_user = answered.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rest = (x0.sum(axis=1, keepdims=True) - x0) / (n_by_user - 1)
+    valid = answered & np.isfinite(rest)
+    rest = np.where(valid, rest, 0.0)
+    x0 = np.where(valid, x0, 0.0)
+
+    # Pearson correlation by column on the valid pairs
+    n = valid.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x = x0.sum(axis=0) / n
+        mean_rest = rest.sum(axis=0) / n
+        dx = np.where(valid, x0 - mean_x, 0.0)
+        dr = np.where(valid, rest - mean_rest, 0.0)
+        discrimination = (dx * dr).sum(axis=0) / np.sqrt(
+            (dx**2).sum(axis=0) * (dr**2).sum(axis=0)
+        )
+    discrimination[(n < 3) | ~np.isfinite(discrimination)] = np.nan
+
+    return questions, p_values, discrimination
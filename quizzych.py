@@ -5,16 +5,21 @@ Quizzych
 
 import hashlib
 import io
+import itertools
 import json
 import logging
 import random
 import re
 import tempfile
+import time
 import tomllib
 import unicodedata
-from functools import wraps
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 from pathlib import Path
+from types import MappingProxyType
 
+import click
 import geojson
 import markdown
 import matplotlib.cm as cm
@@ -25,7 +30,9 @@ import numpy as np
 import pandas as pd
 from flask import (
     Flask,
+    Response,
     flash,
+    g,
     jsonify,
     redirect,
     render_template,
@@ -33,17 +40,27 @@ from flask import (
     send_file,
     send_from_directory,
     session,
+    stream_with_context,
     url_for,
 )
 from markupsafe import Markup
 from PIL import Image
 from rapidfuzz import fuzz
 from shapely.geometry import Point, shape
-from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy import bindparam, text
+from werkzeug.utils import secure_filename
 
+import bulk_load
+import cache
+import db
+import export
 import google_auth_bp
 import moodle_xml
 import quiz
+import result_writer
+import results_archive
+import scores
+import sql_stats
 
 __version__ = "0.2.0"
 __version_date__ = "2026-02-13_22:54:57Z"
@@ -56,8 +73,16 @@ logging.basicConfig(
 
 
 def get_course_config(course: str) -> dict[str, str | list[str]]:
+    """
+    returns the course configuration
+    parsed configurations are kept in course_config_cache
+    """
+    config = course_config_cache.get(course)
+    if config is not None:
+        return config
+
     # check config file
-    with engine.connect() as conn:
+    with db_connection() as conn:
         row = (
             conn.execute(
                 text("SELECT * FROM courses WHERE name = :course"), {"course": course}
@@ -66,24 +91,7 @@ def get_course_config(course: str) -> dict[str, str | list[str]]:
             .fetchone()
         )
         if row:
-            config = {}
-            config["QUIZ_NAME"] = row["name"]
-            config["managers"] = row["managers"]
-            config["INITIAL_LIFE_NUMBER"] = row["initial_life_number"]
-            config["N_QUESTIONS"] = row["topic_question_number"]
-            config["QUESTION_TYPES"] = row["question_types"]
-            config["TOPICS_TO_HIDE"] = row["topics_to_hide"]
-            config["STEP_NAMES"] = row["steps"]
-            config["N_STEPS"] = len(config["STEP_NAMES"])
-            config["N_QUIZ_BY_STEP"] = row["step_quiz_number"]
-            config["N_QUESTIONS_FOR_RECOVER"] = row["recover_question_number"]
-            config["RECOVER_TOPICS"] = row["recover_topics"]
-            config["BRUSH_UP_LEVELS"] = row["brush_up_levels"]
-            config["N_QUESTIONS_BY_BRUSH_UP"] = row["brush_up_question_number"]
-            config["BRUSH_UP_LEVEL_NAMES"] = row["brush_up_level_names"]
-            config["login_mode"] = row["mode"]
-
-            return config
+            return parse_course_config(row)
 
     config = {
         "QUIZ_NAME": course,
@@ -101,56 +109,153 @@ def get_course_config(course: str) -> dict[str, str | list[str]]:
     return config
 
 
+def parse_course_config(row) -> dict[str, str | list[str]]:
+    """
+    returns the course configuration from a row of the courses table
+    and stores it in course_config_cache
+    """
+    config = {}
+    config["QUIZ_NAME"] = row["name"]
+    config["managers"] = row["managers"]
+    config["INITIAL_LIFE_NUMBER"] = row["initial_life_number"]
+    config["N_QUESTIONS"] = row["topic_question_number"]
+    config["QUESTION_TYPES"] = row["question_types"]
+    config["TOPICS_TO_HIDE"] = row["topics_to_hide"]
+    config["STEP_NAMES"] = row["steps"]
+    config["N_STEPS"] = len(config["STEP_NAMES"])
+    config["N_QUIZ_BY_STEP"] = row["step_quiz_number"]
+    config["N_QUESTIONS_FOR_RECOVER"] = row["recover_question_number"]
+    config["RECOVER_TOPICS"] = row["recover_topics"]
+    config["BRUSH_UP_LEVELS"] = row["brush_up_levels"]
+    config["N_QUESTIONS_BY_BRUSH_UP"] = row["brush_up_question_number"]
+    config["BRUSH_UP_LEVEL_NAMES"] = row["brush_up_level_names"]
+    config["login_mode"] = row["mode"]
+
+    course_config_cache.set(row["name"], config)
+    return config
+
+
+# translation catalogues by language: (file mtime, time of last check, translation)
+translations: dict[str, tuple[int, float, MappingProxyType]] = {}
+TRANSLATIONS_CHECK_INTERVAL = 2  # seconds between two checks of the file mtime
+
+
 def get_translation(language: str):
     """
     get translations
+    the catalogue is parsed once and reloaded only if the file was modified
     """
-    if Path(f"translations_{language}.txt").is_file():
-        with open(Path(f"translations_{language}.txt"), "rb") as f:
-            translation = tomllib.load(f)
+    cached = translations.get(language)
+    now = time.monotonic()
+    if cached is not None and now - cached[1] < TRANSLATIONS_CHECK_INTERVAL:
+        return cached[2]
 
-        return translation
-    else:
+    try:
+        mtime = Path(f"translations_{language}.txt").stat().st_mtime_ns
+    except FileNotFoundError:
+        translations.pop(language, None)
         return None
 
+    if cached is not None and cached[0] == mtime:
+        translations[language] = (mtime, now, cached[2])
+        return cached[2]
+
+    with open(Path(f"translations_{language}.txt"), "rb") as f:
+        translation = MappingProxyType(tomllib.load(f))
+    translations[language] = (mtime, now, translation)
+
+    return translation
+
+
+# preload all available translations
+for translation_file in sorted(Path(".").glob("translations_*.txt")):
+    get_translation(translation_file.stem.removeprefix("translations_"))
+
+
+def save_questions(course: str, questions, incremental: bool) -> str:
+    """
+    save questions (iterable of (topic, question dict)) of course in database
+    incremental: update only the modified questions and keep the ids (see bulk_load.merge_questions)
+    otherwise replace all questions of course
+
+    returns a message with the number of loaded questions and the elapsed time
+    raises ValueError if there is no question (the questions of course are not modified)
+    """
+    start = time.perf_counter()
+    questions = iter(questions)
+    first_question = next(questions, None)
+    if first_question is None:
+        raise ValueError("no question found: the questions were not modified")
+    questions = (
+        (topic, add_html(question))
+        for topic, question in itertools.chain([first_question], questions)
+    )
+    with db_connection() as conn:
+        if incremental:
+            summary = bulk_load.merge_questions(conn, course, questions)
+        else:
+            summary = {"questions": bulk_load.copy_questions(conn, course, questions)}
+        # the ids of the questions have changed or results have been linked again
+        if not incremental or summary["relinked"]:
+            scores.rebuild_user_question_stats(conn, course)
+            scores.rebuild_question_stats(conn, course)
+        scores.rebuild_leaderboard(
+            conn, course, get_course_config(course)["TOPICS_TO_HIDE"]
+        )
+        conn.commit()
+
+    invalidate_question(course)
+
+    msg = f"{summary['questions']} questions loaded in {time.perf_counter() - start:.1f} s"
+    if incremental:
+        msg += (
+            f" ({summary['inserted']} new, {summary['updated']} modified, "
+            f"{summary['deleted']} deleted, {summary['unchanged']} unchanged)"
+        )
+    return msg
 
-def load_questions_xml(xml_file: Path, course: str, config: dict) -> int:
+
+def load_questions_xml(
+    xml_file: Path, course: str, config: dict, incremental: bool = False
+) -> int:
     try:
-        # load questions from xml moodle file
-        question_data = moodle_xml.moodle_xml_to_dict_with_images(
-            xml_file, config["QUESTION_TYPES"], f"images/{course}"
+        # load questions from xml moodle file (streaming)
+        msg = save_questions(
+            course,
+            moodle_xml.iter_moodle_xml_questions(
+                xml_file, config["QUESTION_TYPES"], f"images/{course}"
+            ),
+            incremental,
         )
 
-        with engine.connect() as conn:
-            conn.execute(
-                text("DELETE FROM questions WHERE course = :course_name"),
-                {"course_name": course},
-            )
+    except Exception as e:
+        return 1, f"{e}"
+    return 0, msg
 
-            for topic in question_data:
-                for question in question_data[topic]:
-                    conn.execute(
-                        text(
-                            "INSERT INTO questions (course, topic, type, name, content) VALUES (:course_name, :topic, :type, :name, :content)"
-                        ),
-                        {
-                            "course_name": course,
-                            "topic": topic,
-                            "type": question["type"],
-                            "name": question["name"],
-                            "content": json.dumps(question),
-                        },
-                    )
 
-            conn.commit()
+def load_questions_aiken(
+    aiken_file: Path, course: str, config: dict, incremental: bool = False
+) -> int:
+    import aiken
+
+    try:
+        # load questions from Aiken file (streaming)
+        msg = save_questions(
+            course,
+            aiken.iter_aiken_questions(
+                aiken_file, config["QUESTION_TYPES"], f"images/{course}"
+            ),
+            incremental,
+        )
 
     except Exception as e:
-        raise
         return 1, f"{e}"
-    return 0, ""
+    return 0, msg
 
 
-def load_questions_gift(gift_file_path: Path, course: str, config: dict) -> int:
+def load_questions_gift(
+    gift_file_path: Path, course: str, config: dict, incremental: bool = False
+) -> int:
     import gift
 
     try:
@@ -160,37 +265,20 @@ def load_questions_gift(gift_file_path: Path, course: str, config: dict) -> int:
             config["QUESTION_TYPES"],
         )
 
-        count_questions = 0
-
-        with engine.connect() as conn:
-            conn.execute(
-                text("DELETE FROM questions WHERE course = :course"),
-                {"course": course},
-            )
-
-            for topic in question_data:
-                for type_ in question_data[topic]:
-                    for question_name in question_data[topic][type_]:
-                        count_questions += 1
-                        conn.execute(
-                            text(
-                                "INSERT INTO questions (course, topic, type, name, content) VALUES (:course, :topic, :type, :name, :content)"
-                            ),
-                            {
-                                "course": course,
-                                "topic": topic,
-                                "type": type_,
-                                "name": question_name,
-                                "content": json.dumps(
-                                    question_data[topic][type_][question_name]
-                                ),
-                            },
-                        )
-            conn.commit()
+        msg = save_questions(
+            course,
+            (
+                (topic, question_data[topic][type_][question_name])
+                for topic in question_data
+                for type_ in question_data[topic]
+                for question_name in question_data[topic][type_]
+            ),
+            incremental,
+        )
 
     except Exception as e:
         return 1, f"{e}"
-    return 0, f"{count_questions} questions loaded"
+    return 0, msg
 
 
 app = Flask(__name__)
@@ -200,8 +288,219 @@ app.secret_key = "votre_clé_secrète_sécurisée_ici"
 
 app.register_blueprint(google_auth_bp.bp)
 
-DATABASE_URL = app.config["DATABASE_URL"]
-engine = create_engine(DATABASE_URL)
+# one engine (and one connection pool) for the application and the blueprints
+engine = db.engine
+
+sql_stats.init_app(app, engine)
+
+# parsed course configurations (see get_course_config)
+course_config_cache = cache.TTLCache(ttl=app.config.get("COURSE_CONFIG_CACHE_TTL", 60))
+
+# coalesce the concurrent computations of the dashboard of a course
+dashboard_single_flight = cache.SingleFlight()
+
+# parsed questions by (course, question id) (see get_question)
+question_cache = cache.TTLCache(
+    ttl=app.config.get("QUESTION_CACHE_TTL", 300),
+    max_items=app.config.get("QUESTION_CACHE_MAX_ITEMS", 20_000),
+    max_bytes=app.config.get("QUESTION_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+)
+
+
+def get_db():
+    """
+    returns the database connection of the current request
+    the connection is opened at first use and closed by close_db
+    """
+    if "db" not in g:
+        g.db = engine.connect()
+    return g.db
+
+
+@app.teardown_appcontext
+def close_db(exception):
+    """
+    return the connection of the request to the pool
+    """
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.close()
+
+
+def write_results(rows: list[dict]) -> None:
+    """
+    record the results (see scores.record_results) and update the leaderboard
+    of the users in one transaction
+    """
+    user_ids_by_course: dict = {}
+    for row in rows:
+        user_ids_by_course.setdefault(row["course"], set()).add(row["user_id"])
+
+    with db_connection() as conn:
+        scores.record_results(conn, rows)
+        for course, user_ids in user_ids_by_course.items():
+            scores.update_leaderboard(
+                conn,
+                course,
+                sorted(user_ids),
+                get_course_config(course)["TOPICS_TO_HIDE"],
+            )
+        conn.commit()
+
+
+def write_queued_results(rows: list[dict]) -> None:
+    """
+    write the results queued by write_behind (in the thread of the writer)
+    """
+    with app.app_context():
+        write_results(rows)
+
+
+# optional write-behind recording of the results:
+# the answers are written in batches after the feedback is rendered
+write_behind = (
+    result_writer.ResultWriter(
+        write_queued_results,
+        spill_dir=app.config.get("RESULT_WRITE_BEHIND_SPILL_DIR", "result_spill"),
+        flush_interval=app.config.get("RESULT_WRITE_BEHIND_INTERVAL_MS", 200) / 1000,
+        max_rows=app.config.get("RESULT_WRITE_BEHIND_MAX_ROWS", 500),
+        max_queue=app.config.get("RESULT_WRITE_BEHIND_MAX_QUEUE", 100_000),
+        fsync=app.config.get("RESULT_WRITE_BEHIND_FSYNC", True),
+    )
+    if app.config.get("RESULT_WRITE_BEHIND", False)
+    else None
+)
+# start the writer (and the recovery of the spill files) with the worker,
+# forked workers start their own writer (see ResultWriter._after_fork)
+if write_behind is not None:
+    write_behind.start()
+
+
+@contextmanager
+def db_connection():
+    """
+    use the connection shared by the current request
+    the transaction is rolled back if an error occurs
+    """
+    conn = get_db()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def load_request_context(course: str) -> dict | None:
+    """
+    load course, user validity, manager status and lives of the current user
+    in a single query and keep them in g.request_context
+    returns None if the course does not exist
+    """
+    with db_connection() as conn:
+        row = (
+            conn.execute(
+                text(
+                    "SELECT c.*, "
+                    "EXISTS (SELECT 1 FROM users WHERE nickname = :nickname OR email = :email) AS user_exists, "
+                    "(SELECT number FROM lives WHERE course = c.name AND user_id = :user_id) AS lives "
+                    "FROM courses c WHERE c.name = :course"
+                ),
+                {
+                    "course": course,
+                    "nickname": session.get("nickname", ""),
+                    "email": session.get("email", "x"),
+                    "user_id": session.get("user_id"),
+                },
+            )
+            .mappings()
+            .fetchone()
+        )
+    if row is None:
+        return None
+
+    config = parse_course_config(row)
+    if config["login_mode"] == "google_auth":
+        flag_manager = session.get("email", "") in (config["managers"] or [])
+    else:
+        flag_manager = session.get("nickname", "") in (config["managers"] or [])
+
+    g.request_context = {
+        "course": course,
+        "config": config,
+        "user_id": session.get("user_id"),
+        "user_exists": row["user_exists"],
+        "manager": flag_manager,
+        "lives": row["lives"],
+    }
+    return g.request_context
+
+
+def forget_lives() -> None:
+    """
+    discard the number of lives loaded with the request context
+    must be called after every modification of the lives table during a request
+    """
+    if "request_context" in g:
+        g.request_context.pop("lives", None)
+
+
+def load_content(content) -> dict:
+    """
+    returns the question content as dict
+    (JSONB values are already decoded by the driver)
+    """
+    return json.loads(content) if isinstance(content, str) else content
+
+
+def get_question(course: str, question_id: int, include_deleted: bool = False):
+    """
+    returns the parsed content of a question or None if not found
+    the parsed questions are kept in question_cache
+    the returned dict is a copy but nested lists and dicts are shared: do not modify them
+    """
+    key = (course, int(question_id))
+    item = question_cache.get(key)
+    if item is None:
+        with db_connection() as conn:
+            row = (
+                conn.execute(
+                    text(
+                        "SELECT content, deleted, pg_column_size(content) AS size "
+                        "FROM questions WHERE course = :course AND id = :question_id"
+                    ),
+                    {"course": course, "question_id": key[1]},
+                )
+                .mappings()
+                .fetchone()
+            )
+        if row is None:
+            return None
+        item = (load_content(row["content"]), row["deleted"] is not None)
+        question_cache.set(key, item, size=row["size"])
+
+    content, deleted = item
+    if deleted and not include_deleted:
+        return None
+    return dict(content)
+
+
+def invalidate_question(course: str, question_id: int | None = None) -> None:
+    """
+    remove a question (or all questions of course if question_id is None) from cache
+    must be called after every modification of the questions table
+    """
+    if question_id is None:
+        question_cache.invalidate_matching(lambda key: key[0] == course)
+    else:
+        question_cache.invalidate((course, int(question_id)))
+
+
+def invalidate_course_config(course: str) -> None:
+    """
+    remove course configuration from cache
+    must be called after every modification of the courses table
+    """
+    course_config_cache.invalidate(course)
 
 
 def create_database(course) -> None:
@@ -210,13 +509,15 @@ def create_database(course) -> None:
     all fields blank except name
     """
 
-    with engine.connect() as conn:
+    with db_connection() as conn:
         conn.execute(
             text("INSERT INTO courses (name) VALUES (:course_name)"),
             {"course_name": course},
         )
         conn.commit()
 
+    invalidate_course_config(course)
+
     # create image directory if not already exists
     (Path("images") / Path(course)).mkdir(parents=True, exist_ok=True)
 
@@ -230,7 +531,15 @@ def check_login(f):
         else:
             if session["nickname"] != "admin":
                 # check if nickname exists
-                with engine.connect() as conn:
+                context = g.get("request_context")
+                if context is not None:
+                    if not context["user_exists"]:
+                        return redirect(
+                            url_for("google_auth.logout", course=kwargs["course"])
+                        )
+                    return f(*args, **kwargs)
+
+                with db_connection() as conn:
                     if not conn.execute(
                         text(
                             "SELECT count(*) FROM users WHERE nickname = :nickname OR email = :email"
@@ -252,18 +561,9 @@ def check_login(f):
 def course_exists(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        with engine.connect() as conn:
-            if (
-                conn.execute(
-                    text("SELECT name FROM courses WHERE name = :course"),
-                    {"course": kwargs["course"]},
-                )
-                .mappings()
-                .fetchone()
-                is None
-            ):
-                print("The course does not exists")
-                return "The course does not exists"
+        if load_request_context(kwargs["course"]) is None:
+            print("The course does not exists")
+            return "The course does not exists"
         return f(*args, **kwargs)
 
     return decorated_function
@@ -288,11 +588,15 @@ def is_manager_or_admin(f):
         flag_admin = session.get("nickname", "") == "admin"
 
         # check if manager
-        config = get_course_config(kwargs["course"])
-        if config["login_mode"] == "google_auth":
-            flag_manager = session.get("email", "") in config["managers"]
+        context = g.get("request_context")
+        if context is not None and context["course"] == kwargs["course"]:
+            flag_manager = context["manager"]
         else:
-            flag_manager = session.get("nickname", "") in config["managers"]
+            config = get_course_config(kwargs["course"])
+            if config["login_mode"] == "google_auth":
+                flag_manager = session.get("email", "") in config["managers"]
+            else:
+                flag_manager = session.get("nickname", "") in config["managers"]
 
         if not flag_admin and not flag_manager:
             flash(
@@ -322,7 +626,16 @@ def get_lives_number(course: str, user_id: int) -> int | None:
     """
     get number of lives for nickname
     """
-    with engine.connect() as conn:
+    context = g.get("request_context")
+    if (
+        context is not None
+        and "lives" in context
+        and context["course"] == course
+        and context["user_id"] == user_id
+    ):
+        return context["lives"]
+
+    with db_connection() as conn:
         lives = (
             conn.execute(
                 text(
@@ -358,7 +671,7 @@ def main_home():
 
     # get list of courses
     if session.get("nickname", "") == "admin":
-        with engine.connect() as conn:
+        with db_connection() as conn:
             courses = (
                 conn.execute(text("SELECT name FROM courses ORDER BY name"))
                 .mappings()
@@ -383,7 +696,7 @@ def my_quizz():
     """
 
     # get list of courses
-    with engine.connect() as conn:
+    with db_connection() as conn:
         courses = (
             conn.execute(text("SELECT name FROM courses ORDER BY name"))
             .mappings()
@@ -513,12 +826,18 @@ def topic_list(course: str):
 
     print(f"{topics=}")
 
+    scores = (
+        get_scores(course, [session["user_id"]], topics)[session["user_id"]]
+        if "user_id" in session
+        else {}
+    )
+
     return render_template(
         "topic_list.html",
         course_name=config["QUIZ_NAME"],
         course=course,
         topics=topics,
-        # scores=scores,
+        scores=scores,
         lives=lives,
         translation=get_translation("it"),
     )
@@ -553,7 +872,7 @@ def get_visible_topics(course: str) -> list[str]:
 
     print(f"{config["TOPICS_TO_HIDE"]=}")
 
-    with engine.connect() as conn:
+    with db_connection() as conn:
         rows = (
             conn.execute(
                 text(
@@ -584,36 +903,17 @@ def position(course: str):
     display position
     """
 
-    topics = get_visible_topics(course)
-    current_score = sum([get_score(course, topic) for topic in topics]) / len(topics)
-
-    # all scores
-    scores = []
-    with engine.connect() as conn:
-        users = (
-            conn.execute(
-                text(
-                    "SELECT nickname FROM users WHERE nickname NOT IN ('admin', 'manager') AND nickname != :nickname"
-                ),
-                {"nickname": session["nickname"]},
-            )
-            .mappings()
-            .fetchall()
-        )
-        for user in users:
-            scores.append(
-                (
-                    sum([get_score(course, topic) for topic in topics]) / len(topics),
-                    user["nickname"],
-                )
-            )
-    scores.sort(reverse=True)
+    with db_connection() as conn:
+        leaderboard = scores.leaderboard_position(conn, course, session["user_id"])
 
     out: list = []
-    for score, user in scores:
-        if current_score <= score:
-            out.append(f"<strong>{session['nickname']}: {current_score}</strong>")
-        out.append(f"{user}: {score}")
+    for row in leaderboard["before"]:
+        out.append(f"{row['rank']}. {row['nickname']}: {row['score']:.3f}")
+    out.append(
+        f"<strong>{leaderboard['rank']}. {session['nickname']}: {leaderboard['score']:.3f}</strong>"
+    )
+    for row in leaderboard["after"]:
+        out.append(f"{row['rank']}. {row['nickname']}: {row['score']:.3f}")
 
     return "<br>".join(out)
 
@@ -632,7 +932,7 @@ def recover_quiz(course: str):
     # create questions dataframe
     questions_df = get_questions_dataframe(course, session["user_id"])
 
-    with engine.connect() as conn:
+    with db_connection() as conn:
         # get number of questions in recover topic
         if config["RECOVER_TOPICS"]:
             stmt = text(
@@ -691,7 +991,7 @@ def all_topic_quiz(course: str, topic: str):
     """
     create a quiz with all questions of a topic
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         query = text(
             "SELECT id FROM questions WHERE deleted IS NULL AND course = :course AND topic = :topic"
         )
@@ -712,27 +1012,20 @@ def get_questions_dataframe(course: str, user_id: int) -> pd.DataFrame:
     """
     returns pandas dataframe with questions and results for nickname
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         query = text("""
                 SELECT
                     q.id AS question_id,
                     q.topic AS topic,
                     q.type AS type,
                     q.name AS question_name,
-                    SUM(CASE WHEN good_answer = TRUE THEN 1 ELSE 0 END) AS n_ok,
-                    SUM(CASE WHEN good_answer = FALSE THEN 1 ELSE 0 END) AS n_no
-                FROM questions q LEFT JOIN results r
-                    ON q.course = r.course
-                        AND q.topic=r.topic
-                        AND q.type=r.question_type
-                        AND q.name=r.question_name
-                        AND r.user_id = :user_id
+                    COALESCE(s.n_ok, 0) AS n_ok,
+                    COALESCE(s.n_no, 0) AS n_no
+                FROM questions q LEFT JOIN user_question_stats s
+                    ON s.course = :course
+                        AND s.user_id = :user_id
+                        AND s.question_id = q.id
                 WHERE q.course = :course AND q.deleted IS NULL
-                GROUP BY
-                    q.id,
-                    q.topic,
-                    q.type,
-                    q.name
                 """)
 
         result = conn.execute(query, {"course": course, "user_id": user_id})
@@ -836,7 +1129,7 @@ def steps(course: str, topic: str):
         lives = get_lives_number(course, session["user_id"])
 
     steps_active = {x: 0 for x in range(1, config["N_STEPS"] + 1)}
-    with engine.connect() as conn:
+    with db_connection() as conn:
         rows = (
             conn.execute(
                 text(
@@ -878,44 +1171,15 @@ def step(course: str, topic: str, step: int):
 
     config = get_course_config(course)
 
-    with engine.connect() as conn:
-        query = text("""
-                SELECT
-                    q.id AS question_id,
-                    q.topic AS topic,
-                    q.type AS type,
-                    q.name AS question_name,
-                    SUM(CASE WHEN good_answer = TRUE THEN 1 ELSE 0 END) AS n_ok,
-                    SUM(CASE WHEN good_answer = FALSE THEN 1 ELSE 0 END) AS n_no
-                FROM questions q LEFT JOIN results r
-                    ON q.course = r.course
-                        AND q.topic=r.topic
-                        AND q.type=r.question_type
-                        AND q.name=r.question_name
-                        AND r.user_id = :user_id
-                        AND q.deleted IS NULL
-                WHERE q.course = :course
-                GROUP BY
-                    q.id,
-                    q.topic,
-                    q.type,
-                    q.name
-                """)
-
-        result = conn.execute(query, {"course": course, "user_id": session["user_id"]})
-        columns = result.keys()
-        rows = result.mappings().fetchall()
-
-        # convert results in dataframe
-        questions_df = pd.DataFrame(rows, columns=columns)
+    questions_df = get_questions_dataframe(course, session["user_id"])
 
-        steps_df = quiz.crea_tappe(
-            questions_df,
-            topic,
-            config["N_STEPS"],
-            config["N_QUESTIONS"],
-            seed=get_seed(session["nickname"], topic),
-        )
+    steps_df = quiz.crea_tappe(
+        questions_df,
+        topic,
+        config["N_STEPS"],
+        config["N_QUESTIONS"],
+        seed=get_seed(session["nickname"], topic),
+    )
 
     session["quiz"] = quiz.get_quiz(
         topic,
@@ -965,70 +1229,58 @@ def step_testing(course: str, topic: str, step: int):
     return "OK"
 
 
-def get_score(course: str, topic: str, user_id: int = 0) -> float:
+def get_scores(
+    course: str, user_ids: list[int], topics: list[str] | None = None
+) -> dict[int, dict[str, float]]:
     """
-    get score of nickname user for topic
-    if nickname is empty get score of current user
+    get scores of users for topics (all topics if topics is None) with a single query
+    on user_question_stats
+    the score of a topic is the mean of the success rates of its questions
+    (0 for the questions without answer)
+
+    returns {user_id: {topic: score}}, missing topics have a score of 0
     """
+    scores: dict = {user_id: dict.fromkeys(topics or [], 0) for user_id in user_ids}
+    if not user_ids or topics == []:
+        return scores
 
-    with engine.connect() as conn:
-        query = text(
-            """
-             SELECT
-                SUM(percentage_ok) / COUNT(DISTINCT question_name) AS score
-             FROM (
+    topic_filter = "AND topic = ANY(:topics)" if topics is not None else ""
+    with db_connection() as conn:
+        rows = conn.execute(
+            text(
+                f"""
+                WITH topic_questions AS (
+                    SELECT id, topic, COUNT(*) OVER (PARTITION BY topic) AS n_questions
+                    FROM questions
+                    WHERE course = :course AND deleted IS NULL {topic_filter}
+                )
                 SELECT
-                    q.name AS question_name,
-                    CAST(SUM(CASE WHEN r.good_answer = true THEN 1 ELSE 0 END) AS FLOAT) /
-                    NULLIF(COUNT(r.good_answer), 0) AS percentage_ok
-                FROM questions q
-                LEFT JOIN results r
-                    ON q.course = r.course
-                    AND q.name = r.question_name
-                    AND r.user_id = :user_id
-                WHERE q.topic = :topic AND q.deleted IS NULL
-                GROUP BY q.name
-             ) AS subquery
-             """
-            #            """
-            # WITH filtered_results AS (
-            #    SELECT *
-            #    FROM results
-            #    WHERE user_id = :user_id
-            # )
-            # SELECT
-            #    AVG(percentage_ok) AS score
-            # FROM (
-            #    SELECT
-            #        q.name AS question_name,
-            #        AVG(CASE WHEN r.good_answer THEN 1.0 ELSE 0.0 END) AS percentage_ok
-            #    FROM questions q
-            #    LEFT JOIN filtered_results r
-            #        ON q.course = r.course
-            #       AND q.name = r.question_name
-            #    WHERE q.topic = :topic
-            #      AND q.deleted IS NULL
-            #    GROUP BY q.name
-            # ) AS per_question;
-            #
-            #
-            #
-            # """
-        )
-        cursor = conn.execute(
-            query,
-            {
-                "course": course,
-                "topic": topic,
-                "user_id": session["user_id"] if user_id == 0 else user_id,
-            },
-        )
+                    s.user_id,
+                    q.topic,
+                    SUM(CAST(s.n_ok AS FLOAT) / NULLIF(s.n_ok + s.n_no, 0)) / MIN(q.n_questions) AS score
+                FROM user_question_stats s
+                JOIN topic_questions q ON q.id = s.question_id
+                WHERE s.course = :course AND s.user_id = ANY(:user_ids)
+                GROUP BY s.user_id, q.topic
+                """
+            ),
+            {"course": course, "user_ids": list(user_ids), "topics": topics},
+        ).mappings()
 
-        score = cursor.fetchone()[0]
-        if score is not None:
-            return round(score, 3)
-        else:
-            return 0
+        for row in rows:
+            if row["score"] is not None:
+                scores[row["user_id"]][row["topic"]] = round(row["score"], 3)
+
+    return scores
+
+
+def get_score(course: str, topic: str, user_id: int = 0) -> float:
+    """
+    get score of nickname user for topic
+    if nickname is empty get score of current user
+    """
+    user_id = session["user_id"] if user_id == 0 else user_id
+    return get_scores(course, [user_id], [topic])[user_id][topic]
 
 
 @app.route(
@@ -1038,7 +1290,7 @@ def get_score(course: str, topic: str, user_id: int = 0) -> float:
 def bookmark_checkbox(question_id: int):
     if request.is_json:
         is_checked = request.json.get("checked")
-        with engine.connect() as conn:
+        with db_connection() as conn:
             if is_checked:
                 conn.execute(
                     text(
@@ -1064,7 +1316,7 @@ def delete_bookmark(course: str, question_id: int):
     """
     delete a question from bookmarks
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         conn.execute(
             text("DELETE FROM bookmarks WHERE question_id = :question_id"),
             {"question_id": question_id},
@@ -1074,14 +1326,45 @@ def delete_bookmark(course: str, question_id: int):
     return redirect(url_for("bookmarked_questions", course=course))
 
 
+@lru_cache(maxsize=8192)
+def render_markdown(s: str) -> str:
+    """
+    convert markdown in HTML without paragraphs
+    results are cached by content
+    """
+    return markdown.markdown(s).replace("<p>", "").replace("</p>", "")
+
+
 def md2html(s: str, markup: bool = True) -> str:
     """
     convert markdown in HTML
     """
-    out = markdown.markdown(s).replace("<p>", "").replace("</p>", "")
+    out = render_markdown(s)
     return Markup(out) if markup else out
 
 
+def add_html(question: dict) -> dict:
+    """
+    add the HTML rendering of question text and answers feedback
+    (*_html keys) to the question content
+    must be called before saving a question in the database
+    """
+    question["questiontext_html"] = render_markdown(question.get("questiontext") or "")
+    for answer in question.get("answers", []):
+        answer["feedback_html"] = render_markdown(answer.get("feedback") or "")
+    return question
+
+
+def html_field(question: dict, field: str) -> str:
+    """
+    returns the HTML of a field of question
+    the field is rendered if the question was saved without HTML
+    """
+    if f"{field}_html" in question:
+        return Markup(question[f"{field}_html"])
+    return md2html(question.get(field) or "")
+
+
 @app.route(
     f"{app.config['APPLICATION_ROOT']}/question/<course>/<topic>/<int:step>/<int:idx>",
     methods=["GET"],
@@ -1098,7 +1381,7 @@ def question(course: str, topic: str, step: int, idx: int):
 
     if "recover" not in session and "brush-up" not in session:
         # check step index
-        with engine.connect() as conn:
+        with db_connection() as conn:
             rows = (
                 conn.execute(
                     (
@@ -1141,17 +1424,7 @@ def question(course: str, topic: str, step: int, idx: int):
     if idx < len(session["quiz"]):
         question_id = session["quiz"][idx]
         # get question content
-        with engine.connect() as conn:
-            question = json.loads(
-                conn.execute(
-                    text(
-                        "SELECT content FROM questions WHERE course= :course AND deleted IS NULL AND id = :question_id"
-                    ),
-                    {"course": course, "question_id": question_id},
-                )
-                .mappings()
-                .fetchone()["content"]
-            )
+        question = get_question(course, question_id)
     else:
         # step/quiz finished
         del session["quiz"]
@@ -1166,7 +1439,7 @@ def question(course: str, topic: str, step: int, idx: int):
 
         else:
             # normal quiz
-            with engine.connect() as conn:
+            with db_connection() as conn:
                 result = conn.execute(
                     text(
                         "SELECT number FROM steps "
@@ -1254,7 +1527,7 @@ def question(course: str, topic: str, step: int, idx: int):
             else translation["Input a text"]
         )
 
-    question["questiontext"] = md2html(question["questiontext"])
+    question["questiontext"] = html_field(question, "questiontext")
 
     return render_template(
         "question.html",
@@ -1369,17 +1642,7 @@ def view_question_id(course: str = "", question_id: int = 0):
     config = get_course_config(course)
 
     # get question content
-    with engine.connect() as conn:
-        question = json.loads(
-            conn.execute(
-                text(
-                    "SELECT content FROM questions WHERE course= :course AND id = :question_id"
-                ),
-                {"course": course, "question_id": question_id},
-            )
-            .mappings()
-            .fetchone()["content"]
-        )
+    question = get_question(course, question_id, include_deleted=True)
 
     # check presence of images
     image_list: list = []
@@ -1412,7 +1675,7 @@ def view_question_id(course: str = "", question_id: int = 0):
             else translation["Input a text"]
         )
 
-    question["questiontext"] = md2html(question["questiontext"])
+    question["questiontext"] = html_field(question, "questiontext")
 
     return render_template(
         "question.html",
@@ -1524,14 +1787,20 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
     config = get_course_config(course)
     translation = get_translation("it")
 
+    def feedback_html(answer: dict) -> str:
+        """
+        HTML of the feedback of answer (rendered at import, see add_html)
+        """
+        if "feedback_html" in answer:
+            return answer["feedback_html"]
+        return md2html(answer.get("feedback") or "", markup=False)
+
     def format_correct_answer(answer_feedback):
         """
-        format feedback for good answer
+        format feedback (HTML) for good answer
         """
         out: list = []
         if answer_feedback:
-            answer_feedback = md2html(answer_feedback, markup=False)
-
             """if answer_feedback.count("*") == 2:
                 answer_feedback = answer_feedback.replace("*", "<i>", 1)
                 answer_feedback = answer_feedback.replace("*", "</i>", 1)
@@ -1544,11 +1813,10 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
 
     def format_wrong_answer(answer_feedback, correct_answers):
         """
-        format feedback for wrong answer
+        format feedback (HTML) for wrong answer
         """
         out: list = []
         if answer_feedback:
-            answer_feedback = md2html(answer_feedback, markup=False)
             """
             if answer_feedback.count("*") == 2:
                 answer_feedback = answer_feedback.replace("*", "<i>", 1)
@@ -1606,17 +1874,7 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
     # get question content
     print(question_id)
     print(course)
-    with engine.connect() as conn:
-        question = json.loads(
-            conn.execute(
-                text(
-                    "SELECT content FROM questions WHERE course = :course AND id = :id"
-                ),
-                {"course": course, "id": question_id},
-            )
-            .mappings()
-            .fetchone()["content"]
-        )
+    question = get_question(course, question_id, include_deleted=True)
 
     if request.method == "GET":
         # get user answer
@@ -1663,10 +1921,8 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
 
     correct_answers: list = []
 
-    response = {"questiontext": question["questiontext"]}
-
     # convert *word* to italic
-    response["questiontext"] = md2html(response["questiontext"])
+    response = {"questiontext": html_field(question, "questiontext")}
     """
     if response["questiontext"].count("*") == 2:
         response["questiontext"] = response["questiontext"].replace("*", "<i>", 1)
@@ -1681,9 +1937,7 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
             for user_answer in user_answer_list:
                 if user_answer == answer["text"]:
                     response["correct_answer"] = answer["fraction"] == "100"
-                    response["feedback"] = (
-                        answer["feedback"] if answer["feedback"] is not None else ""
-                    )
+                    response["feedback"] = feedback_html(answer)
 
         if "correct_answer" not in response:
             response["correct"] = False
@@ -1717,15 +1971,11 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
                 answers[score] = {
                     "correct_answer": answer["fraction"] == "100",
                     "match": match,
-                    "feedback": answer["feedback"]
-                    if answer["feedback"] is not None
-                    else "",
+                    "feedback": feedback_html(answer),
                     "reply": reply,
                 }
             else:
-                negative_feedback = (
-                    answer["feedback"] if answer["feedback"] is not None else ""
-                )
+                negative_feedback = feedback_html(answer)
 
         logging.debug(f"good {answers=}")
 
@@ -1780,9 +2030,7 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
                     answers[score] = {
                         "correct_answer": False,
                         "match": match,
-                        "feedback": answer["feedback"]
-                        if answer["feedback"] is not None
-                        else "",
+                        "feedback": feedback_html(answer),
                     }
 
             logging.debug(f"wrong {answers=}")
@@ -1793,7 +2041,7 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
 
                 # remove a life if not recover
                 if "recover" not in session:
-                    with engine.connect() as conn:
+                    with db_connection() as conn:
                         conn.execute(
                             text(
                                 "UPDATE lives SET number = number - 1 WHERE course = :course AND number > 0 AND user_id = :user_id "
@@ -1801,6 +2049,7 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
                             {"course": course, "user_id": session["user_id"]},
                         )
                         conn.commit()
+                        forget_lives()
 
             else:
                 if answers[sorted(answers)[-1]]["match"]:  # user gave wrong answer
@@ -1815,7 +2064,7 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
 
                     # remove a life if not recover
                     if "recover" not in session:
-                        with engine.connect() as conn:
+                        with db_connection() as conn:
                             conn.execute(
                                 text(
                                     "UPDATE lives SET number = number - 1 WHERE course = :course AND number > 0 AND user_id = :user_id "
@@ -1823,6 +2072,7 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
                                 {"course": course, "user_id": session["user_id"]},
                             )
                             conn.commit()
+                            forget_lives()
                 else:
                     response["result"] = Markup(
                         format_wrong_answer("", correct_answers)
@@ -1850,7 +2100,7 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
             flag_recovered = True
 
             # add a new life
-            with engine.connect() as conn:
+            with db_connection() as conn:
                 conn.execute(
                     text(
                         f"UPDATE lives SET number = number + 1 WHERE course = :course AND user_id = :user_id and number < {config['INITIAL_LIFE_NUMBER']}"
@@ -1858,25 +2108,23 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
                     {"course": course, "user_id": session["user_id"]},
                 )
                 conn.commit()
+                forget_lives()
 
         # save result
         if "recover" not in session:
-            with engine.connect() as conn:
-                conn.execute(
-                    text(
-                        "INSERT INTO results (course, user_id, topic, question_type, question_name, good_answer) "
-                        "VALUES (:course, :user_id, :topic, :question_type, :question_name, :good_answer)"
-                    ),
-                    {
-                        "course": course,
-                        "user_id": session["user_id"],
-                        "topic": topic,
-                        "question_type": question["type"],
-                        "question_name": question["name"],
-                        "good_answer": response["correct"],
-                    },
-                )
-                conn.commit()
+            result = {
+                "course": course,
+                "user_id": session["user_id"],
+                "question_id": question_id,
+                "topic": topic,
+                "question_type": question["type"],
+                "question_name": question["name"],
+                "good_answer": response["correct"],
+            }
+            if write_behind is not None:
+                write_behind.submit(result)
+            else:
+                write_results([result])
 
         popup: str = ""
         popup_text: str = ""
@@ -1894,42 +2142,33 @@ def check_answer(course: str, topic: str, step: int, idx: int, user_answer: str
 
     # get overall score (for admin)
     if session["nickname"] == "admin" or session["manager"]:
-        with engine.connect() as conn:
-            overall = {}
-
-            for row in (
+        with db_connection() as conn:
+            # admin answers are not counted in question_stats
+            overall = (
                 conn.execute(
                     text(
-                        "SELECT good_answer, count(*) AS n "
-                        "FROM results "
-                        "WHERE course = :course "
-                        "AND topic = :topic "
-                        "AND question_name = :question_name "
-                        "AND user_id != 0 "  # admin
-                        "GROUP BY good_answer "
+                        "SELECT n_answers, n_ok, discrimination FROM question_stats "
+                        "WHERE question_id = :question_id AND n_answers > 0"
                     ),
-                    {
-                        "course": course,
-                        "topic": topic,
-                        "question_name": question["name"],
-                    },
+                    {"question_id": question_id},
                 )
                 .mappings()
-                .all()
-            ):
-                overall[row["good_answer"]] = row["n"]
+                .first()
+            )
 
         overall_str = (
-            f"{overall.get(1, 0) / (overall.get(1, 0) + overall.get(0, 0)):0.3f} ({overall.get(1, 0) + overall.get(0, 0)} answers)"
+            f"{overall['n_ok'] / overall['n_answers']:0.3f} ({overall['n_answers']} answers)"
             if overall
             else ""
         )
+        if overall and overall["discrimination"] is not None:
+            overall_str += f" discrimination {overall['discrimination']:0.2f}"
     else:
         overall_str = ""
 
     # check if question in bookmarks
     if session["nickname"] == "admin" or session["manager"]:
-        with engine.connect() as conn:
+        with db_connection() as conn:
             bookmarked = conn.execute(
                 text("SELECT COUNT(*) FROM bookmarks WHERE question_id = :question_id"),
                 {"question_id": question_id},
@@ -1974,89 +2213,67 @@ def results(course: str, mode: str = "mean"):
     display results for all users
     """
 
-    with engine.connect() as conn:
-        topics = get_visible_topics(course)
+    topics = get_visible_topics(course)
 
-        users = (
+    # number of answers by topic of each user of the course
+    with db_connection() as conn:
+        rows = (
             conn.execute(
                 text(
-                    (
-                        "SELECT * FROM users WHERE "
-                        ":course = ANY(quizz) "
-                        "AND email <> ALL(SELECT unnest(managers) FROM courses WHERE name = :course)"
+                    """
+                    WITH course_users AS (
+                        SELECT id, email FROM users
+                        WHERE :course = ANY(quizz)
+                            AND email <> ALL(SELECT unnest(managers) FROM courses WHERE name = :course)
                     )
+                    SELECT u.id AS user_id, u.email, r.topic, r.n_questions
+                    FROM course_users u
+                    LEFT JOIN (
+                        SELECT user_id, topic, count(*) AS n_questions
+                        FROM results
+                        WHERE course = :course
+                        GROUP BY user_id, topic
+                    ) r ON r.user_id = u.id
+                    ORDER BY u.id, r.topic
+                    """
                 ),
                 {"course": course},
             )
             .mappings()
             .all()
         )
-        scores: dict = {}
-        scores_by_topic: dict = {}
-        n_questions: dict = {}
-        n_topics: dict = {}
-        n_questions_by_topic = None
-
-        for user in users:
-            tot_score = 0
 
-            user_topics = (
-                conn.execute(
-                    text(
-                        "SELECT DISTINCT topic FROM results WHERE course = :course AND user_id = :user_id"
-                    ),
-                    {"course": course, "user_id": user["id"]},
-                )
-                .mappings()
-                .all()
+    # scores of all users for all topics
+    users_scores = get_scores(course, list({row["user_id"] for row in rows}))
+
+    scores: dict = {}
+    scores_by_topic: dict = {}
+    n_questions: dict = {}
+    n_topics: dict = {}
+    n_questions_by_topic: dict = {}
+
+    for row in rows:
+        email = row["email"]
+        n_topics.setdefault(email, 0)
+        n_questions.setdefault(email, 0)
+        if row["topic"] is None:
+            continue
+
+        score = users_scores[row["user_id"]].get(row["topic"], 0)
+        logging.debug(f"user name: {email} topic: {row['topic']}  score: {score}")
+
+        scores_by_topic.setdefault(email, {})[row["topic"]] = score
+        n_questions_by_topic[(email, row["topic"])] = row["n_questions"]
+        n_topics[email] += 1
+        n_questions[email] += row["n_questions"]
+
+    for email in n_topics:
+        if n_topics[email]:
+            scores[email] = round(
+                sum(scores_by_topic[email].values()) / n_topics[email], 3
             )
-
-            n_topics[user["email"]] = len(user_topics)
-
-            if mode == "by_topic":
-                n_questions_by_topic: dict = {}
-                n_questions_topic = (
-                    conn.execute(
-                        text(
-                            "SELECT user_id, topic, count(*) AS n_questions FROM results WHERE course = :course GROUP BY user_id, topic"
-                        ),
-                        {"course": course},
-                    )
-                    .mappings()
-                    .all()
-                )
-
-                for row in n_questions_topic:
-                    n_questions_by_topic[(row["user_id"], row["topic"])] = row[
-                        "n_questions"
-                    ]
-
-            for row in user_topics:
-                score = get_score(course, row["topic"], user_id=user["id"])
-
-                logging.debug(
-                    f"user name: {user['email']} topic: {row['topic']}  score: {score}"
-                )
-
-                if user["email"] not in scores_by_topic:
-                    scores_by_topic[user["email"]] = {}
-
-                if row["topic"] not in scores_by_topic[user["email"]]:
-                    scores_by_topic[user["email"]][row["topic"]] = score
-
-                tot_score += score
-
-            if len(user_topics):
-                scores[user["email"]] = round(tot_score / len(user_topics), 3)
-            else:
-                scores[user["email"]] = "-"
-
-            n_questions[user["email"]] = conn.execute(
-                text(
-                    "SELECT count(*) FROM results WHERE course = :course AND user_id = :user_id"
-                ),
-                {"course": course, "user_id": user["id"]},
-            ).scalar()
+        else:
+            scores[email] = "-"
 
     print(f"{scores=}")
     print(f"{scores_by_topic=}")
@@ -2087,7 +2304,7 @@ def course_management(course: str):
     config = get_course_config(course)
     translation = get_translation("it")
 
-    with engine.connect() as conn:
+    with db_connection() as conn:
         questions_number = conn.execute(
             text(
                 "SELECT COUNT(*) FROM questions WHERE deleted IS NULL AND course = :course"
@@ -2130,111 +2347,13 @@ def course_management(course: str):
             .all()
         )
 
-        n_questions_by_day = (
-            conn.execute(
-                text(
-                    (
-                        "SELECT to_char(timestamp, 'YYYY-MM-DD') AS day, count(*) AS n_questions, count(distinct user_id) AS n_users FROM results "
-                        "WHERE course = :course AND user_id != 0 GROUP BY day ORDER BY day"
-                    )
-                ),
-                {"course": course},
-            )
-            .mappings()
-            .all()
-        )
-
-        active_users_last_hour = conn.execute(
-            text(
-                (
-                    "SELECT COUNT(distinct user_id)  FROM results "
-                    "WHERE course = :course AND  user_id != 0 AND timestamp >= NOW() - INTERVAL '1 hour'"
-                )
-            ),
-            {"course": course},
-        ).scalar()
-
-        active_users_last_day = conn.execute(
-            text(
-                (
-                    "SELECT count(distinct user_id) FROM results "
-                    "WHERE course = :course AND user_id != 0 AND timestamp >= NOW() - INTERVAL '1 day'"
-                )
-            ),
-            {"course": course},
-        ).scalar()
-
-        active_users_last_week = conn.execute(
-            text(
-                "SELECT count(distinct user_id) FROM results "
-                "WHERE course = :course AND user_id != 0 AND timestamp >= NOW() - INTERVAL '7 days'"
-            ),
-            {"course": course},
-        ).scalar()
-
-        active_users_last_month = conn.execute(
-            text(
-                "SELECT count(distinct user_id) FROM results "
-                "WHERE course = :course AND user_id != 0 AND timestamp >= NOW() - INTERVAL '30 days'"
-            ),
-            {"course": course},
-        ).scalar()
-
-        by_hour = (
-            conn.execute(
-                text(
-                    "SELECT "
-                    '    EXTRACT(HOUR FROM "timestamp")::integer AS hour, '
-                    "    COUNT(*) AS count_by_hour "
-                    "FROM results WHERE course = :course "
-                    "GROUP BY hour "
-                    "ORDER BY hour "
-                ),
-                {"course": course},
-            )
-            .mappings()
-            .all()
-        )
-
-        # accuracy percentage by question type
-        accuracy_percentage_by_question_type = (
-            conn.execute(
-                text(
-                    "SELECT  "
-                    "    question_type, "
-                    "    ROUND(100.0 * SUM(CASE WHEN good_answer THEN 1 ELSE 0 END) / COUNT(*), 2) AS accuracy_percentage  "
-                    "FROM results WHERE course = :course  "
-                    "GROUP BY question_type "
-                    "ORDER BY accuracy_percentage ASC; "
-                ),
-                {"course": course},
-            )
-            .mappings()
-            .all()
-        )
-
-        # accuracy percentage by topic
-        accuracy_percentage_by_topic = (
-            conn.execute(
-                text(
-                    "SELECT  "
-                    "    topic, "
-                    "    ROUND(100.0 * SUM(CASE WHEN good_answer THEN 1 ELSE 0 END) / COUNT(*), 2) AS success_rate "
-                    "FROM results WHERE course = :course  "
-                    "GROUP BY topic "
-                    "ORDER BY topic ASC; "
-                ),
-                {"course": course},
-            )
-            .mappings()
-            .all()
-        )
-
-        accuracy_percentage_by_topic = {
-            item["topic"]: round(float(item["success_rate"]), 2)
-            for item in accuracy_percentage_by_topic
-        }
+    # statistics of the answers from the hourly rollups
+    # concurrent requests for the same course share the same computation
+    answers_stats = dashboard_single_flight.do(
+        course, lambda: scores.dashboard_stats(get_db(), course)
+    )
 
+    with db_connection() as conn:
         # most wrong questions for current course
         most_wrong_questions = (
             conn.execute(
@@ -2249,18 +2368,15 @@ def course_management(course: str):
                             WHEN q.type = 'multichoice' THEN 'multi'
                             ELSE q.type
                         END AS type,
-                        SUBSTRING(q.content::json ->> 'questiontext', 1, 140) AS question_text,
-                        COUNT(*) AS num_answers,
-                        ROUND(
-                            100.0 * SUM(CASE WHEN r.good_answer THEN 1 ELSE 0 END) / COUNT(*),
-                            2
-                        ) AS success_rate
-                    FROM results r
-                    JOIN questions q ON r.question_name = q.name
-                    WHERE r.course = :course
-                        AND q.course = :course
+                        SUBSTRING(q.questiontext, 1, 140) AS question_text,
+                        s.n_answers AS num_answers,
+                        ROUND(100.0 * s.n_ok / s.n_answers, 2) AS success_rate,
+                        ROUND(CAST(s.discrimination AS NUMERIC), 2) AS discrimination
+                    FROM question_stats s
+                    JOIN questions q ON s.question_id = q.id
+                    WHERE s.course = :course
+                        AND s.n_answers > 0
                         AND q.deleted IS NULL
-                    GROUP BY q.id, q.name, q.topic, q.type, q.content
                     ORDER BY success_rate ASC, num_answers DESC
                     LIMIT 100
                     """
@@ -2279,17 +2395,21 @@ def course_management(course: str):
         topics=topics,
         users_number=users_number,
         topics_list=topics_list,
-        active_users_last_hour=active_users_last_hour,
-        active_users_last_day=active_users_last_day,
-        active_users_last_week=active_users_last_week,
-        active_users_last_month=active_users_last_month,
-        days=Markup(str([x["day"] for x in n_questions_by_day])),
-        n_questions_by_day=Markup(str([x["n_questions"] for x in n_questions_by_day])),
-        n_users_by_day=Markup(str([x["n_users"] for x in n_questions_by_day])),
+        active_users_last_hour=answers_stats["active_users"]["last_hour"],
+        active_users_last_day=answers_stats["active_users"]["last_day"],
+        active_users_last_week=answers_stats["active_users"]["last_week"],
+        active_users_last_month=answers_stats["active_users"]["last_month"],
+        days=Markup(str([x["day"] for x in answers_stats["by_day"]])),
+        n_questions_by_day=Markup(
+            str([x["n_questions"] for x in answers_stats["by_day"]])
+        ),
+        n_users_by_day=Markup(str([x["n_users"] for x in answers_stats["by_day"]])),
         return_url=url_for("course_management", course=course),
-        hours=Markup(str([x["hour"] for x in by_hour])),
-        count_by_hour=Markup(str([x["count_by_hour"] for x in by_hour])),
-        accuracy_percentage_by_topic=accuracy_percentage_by_topic,
+        hours=Markup(str([x["hour"] for x in answers_stats["by_hour"]])),
+        count_by_hour=Markup(
+            str([x["count_by_hour"] for x in answers_stats["by_hour"]])
+        ),
+        accuracy_percentage_by_topic=answers_stats["accuracy_by_topic"],
         most_wrong_questions=most_wrong_questions,
         translation=translation,
     )
@@ -2304,47 +2424,53 @@ def course_management(course: str):
 @is_manager_or_admin
 def delete_image(course: str, image_name: str, question_id: int, return_url: str):
     """
-    delete images and json (if any) from a question
+    delete an image from a question
+    the images are shared by the questions of the course (content-addressed names):
+    the image and its json (image areas, if any) are deleted when no other question uses it
     """
-    if (Path("images") / Path(course) / Path(image_name).name).is_file():
-        (Path("images") / Path(course) / Path(image_name).name).unlink()
+    with db_connection() as conn:
+        question = (
+            conn.execute(
+                text(
+                    "SELECT * FROM questions WHERE course = :course AND id = :question_id"
+                ),
+                {"course": course, "question_id": question_id},
+            )
+            .mappings()
+            .fetchone()
+        )
+        content = load_content(question["content"])
+        # delete all references to image in question
+        while image_name in content["files"]:
+            content["files"].remove(image_name)
 
-        # check for json file (image areas) to delete
-        if (
-            Path("images")
-            / Path(course)
-            / Path(Path(image_name).name).with_suffix(Path(image_name).suffix + ".json")
-        ).is_file():
-            (
-                Path("images")
-                / Path(course)
-                / Path(Path(image_name).name).with_suffix(
-                    Path(image_name).suffix + ".json"
-                )
-            ).unlink()
+        conn.execute(
+            text("UPDATE questions SET content = :content WHERE id = :question_id"),
+            {"content": json.dumps(content), "question_id": question_id},
+        )
 
-        with engine.connect() as conn:
-            question = (
-                conn.execute(
-                    text(
-                        "SELECT * FROM questions WHERE course = :course AND id = :question_id"
-                    ),
-                    {"course": course, "question_id": question_id},
-                )
-                .mappings()
-                .fetchone()
-            )
-            content = json.loads(question["content"])
-            # delete all references to image in question
-            while image_name in content["files"]:
-                content["files"].remove(image_name)
+        # other questions of the course using the image
+        image_used = conn.execute(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM questions "
+                "WHERE course = :course AND id <> :question_id "
+                "AND files @> jsonb_build_array(CAST(:image_name AS TEXT)))"
+            ),
+            {"course": course, "question_id": question_id, "image_name": image_name},
+        ).scalar()
 
-            conn.execute(
-                text("UPDATE questions SET content = :content WHERE id = :question_id"),
-                {"content": json.dumps(content), "question_id": question_id},
-            )
+        conn.commit()
 
-            conn.commit()
+    image_path = Path("images") / Path(course) / Path(image_name).name
+    if not image_used and image_path.is_file():
+        image_path.unlink()
+
+        # check for json file (image areas) to delete
+        json_path = image_path.with_suffix(image_path.suffix + ".json")
+        if json_path.is_file():
+            json_path.unlink()
+
+    invalidate_question(course, question_id)
 
     return redirect(
         url_for(
@@ -2364,7 +2490,7 @@ def delete_image(course: str, image_name: str, question_id: int, return_url: str
 @is_manager_or_admin
 def load_questions(course: str):
     """
-    load questions from file (XML or GIFT)
+    load questions from file (XML, GIFT or Aiken)
     """
 
     if request.method == "GET":
@@ -2382,8 +2508,8 @@ def load_questions(course: str):
             return redirect(request.url)
 
         # check file name
-        if Path(file.filename).suffix not in (".xml", ".gift"):
-            flash("The file name must end in .xml or .gift")
+        if Path(file.filename).suffix not in (".xml", ".gift", ".txt"):
+            flash("The file name must end in .xml, .gift or .txt (Aiken)")
             return redirect(request.url)
 
         if file:
@@ -2391,13 +2517,18 @@ def load_questions(course: str):
             file.save(file_path)
 
             # load questions in database
+            incremental = request.form.get("incremental") is not None
             if Path(file_path).suffix == ".gift":
                 r, msg = load_questions_gift(
-                    file_path, course, get_course_config(course)
+                    file_path, course, get_course_config(course), incremental
+                )
+            elif Path(file_path).suffix == ".txt":
+                r, msg = load_questions_aiken(
+                    file_path, course, get_course_config(course), incremental
                 )
             else:
                 r, msg = load_questions_xml(
-                    file_path, course, get_course_config(course)
+                    file_path, course, get_course_config(course), incremental
                 )
             if r:
                 flash(f"Error loading questions from {file.filename}: {msg}")
@@ -2428,7 +2559,7 @@ def edit_parameters(course: str):
 @check_login
 @is_manager_or_admin
 def add_lives(course: str):
-    with engine.connect() as conn:
+    with db_connection() as conn:
         conn.execute(
             text(
                 "UPDATE lives SET number = number + 10 WHERE course = :course AND user_id = :user_id "
@@ -2436,6 +2567,7 @@ def add_lives(course: str):
             {"course": course, "user_id": session["user_id"]},
         )
         conn.commit()
+        forget_lives()
 
     flash(
         Markup('<div class="notification is-success">10 lives added to manager</div>'),
@@ -2454,7 +2586,7 @@ def all_questions(course: str):
     display all questions
     """
 
-    with engine.connect() as conn:
+    with db_connection() as conn:
         questions = (
             conn.execute(
                 text(
@@ -2468,7 +2600,7 @@ def all_questions(course: str):
 
         content: dict = {}
         for row in questions:
-            content[row["id"]] = json.loads(row["content"])
+            content[row["id"]] = load_content(row["content"])
 
     return render_template(
         "all_questions.html",
@@ -2492,7 +2624,7 @@ def all_topic_questions(course: str, topic: str):
     display all questions from topic
     """
 
-    with engine.connect() as conn:
+    with db_connection() as conn:
         questions = (
             conn.execute(
                 text(
@@ -2506,7 +2638,7 @@ def all_topic_questions(course: str, topic: str):
 
         content: dict = {}
         for row in questions:
-            content[row["id"]] = json.loads(row["content"])
+            content[row["id"]] = load_content(row["content"])
 
     return render_template(
         "all_questions.html",
@@ -2530,7 +2662,7 @@ def deleted_questions(course: str):
     display deleted questions
     """
 
-    with engine.connect() as conn:
+    with db_connection() as conn:
         questions = (
             conn.execute(
                 text(
@@ -2544,7 +2676,7 @@ def deleted_questions(course: str):
 
         content: dict = {}
         for row in questions:
-            content[row["id"]] = json.loads(row["content"])
+            content[row["id"]] = load_content(row["content"])
 
     return render_template(
         "all_questions.html",
@@ -2577,7 +2709,7 @@ def all_images(course: str):
     """
     display all images
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         questions = (
             conn.execute(
                 text(
@@ -2591,7 +2723,7 @@ def all_images(course: str):
 
         content: dict = {}
         for row in questions:
-            content[row["id"]] = json.loads(row["content"])
+            content[row["id"]] = load_content(row["content"])
             image_list = []
             for image in content[row["id"]].get("files", []):
                 if image.startswith("http"):
@@ -2630,75 +2762,79 @@ def all_questions_gift(course: str):
     display all questions in gift format
     """
 
-    out: list = []
-    with engine.connect() as conn:
-        for row in (
-            conn.execute(
-                text(
-                    "SELECT * FROM questions WHERE deleted IS NULL AND course = :course ORDER BY id"
-                ),
-                {"course": course},
-            )
-            .mappings()
-            .fetchall()
-        ):
-            # out.append(f"::{row['id']}")
-            # category / topic
-            out.append(f"$CATEGORY: {row['topic']}")
-            out.append("")
-            out.append(f"::{row['name']}")
-
-            content = json.loads(row["content"])
-            if row["type"] == "truefalse":
-                for answer in content["answers"]:
-                    if answer["fraction"] == "100":
-                        ans = answer["text"][0].upper()
-                        feed_good = answer["feedback"]
-                    else:
-                        feed_wrong = answer["feedback"]
-
-                if feed_good and feed_wrong:
-                    out.append(f"::{content['questiontext']}" + "{")
-                    out.append(f"{ans}#{feed_wrong}#{feed_good}")
-                    if content.get("generalfeedback", None):
-                        out.append(f"####{content['generalfeedback']}")
-                    out.append("}")
-                else:
-                    out.append(f"::{content['questiontext']}")
-                    if content.get("generalfeedback", None):
-                        out.append(f"{{{ans}}}####{content['generalfeedback']}")
-                    else:
-                        out.append(f"{{{ans}}}")
+    def html_lines():
+        yield "<pre>"
+        for chunk in export.iter_gift(course, iter_course_questions(course)):
+            yield str(Markup.escape(chunk))
+        yield "</pre>"
 
-            if row["type"] == "multichoice":
-                out.append(f"::{content['questiontext']} " + "{")
-                for answer in content["answers"]:
-                    if answer["fraction"] == "100":
-                        out.append(f"={answer['text']}#{answer['feedback']}")
-                    else:
-                        out.append(f"~{answer['text']}#{answer['feedback']}")
+    return Response(stream_with_context(html_lines()), mimetype="text/html")
 
-                if content.get("generalfeedback", None):
-                    out.append(f"####{content['generalfeedback']}")
-                out.append("}")
 
-            if row["type"] == "shortanswer":
-                out.append(f"::{content['questiontext']}" + "{")
-                for answer in content["answers"]:
-                    if answer["fraction"] == "100":
-                        out.append(f"=%100%{answer['text']}#{answer['feedback']}")
-                    else:
-                        out.append(
-                            f"=%{answer['fraction']}%{answer['text']}#{answer['feedback']}"
-                        )
-                if content.get("generalfeedback", None):
-                    out.append(f"####{content['generalfeedback']}")
+def iter_course_questions(course: str):
+    """
+    yield (topic, question dict) of the questions of course ordered by topic
+    the rows are fetched by batches with a server-side cursor
+    """
+    with db_connection() as conn:
+        for row in conn.execute(
+            text(
+                "SELECT topic, type, name, content FROM questions "
+                "WHERE deleted IS NULL AND course = :course ORDER BY topic, id"
+            ),
+            {"course": course},
+            execution_options={
+                "stream_results": True,
+                "yield_per": app.config.get("EXPORT_YIELD_PER", 500),
+            },
+        ).mappings():
+            question = load_content(row["content"])
+            yield row["topic"], {**question, "type": row["type"], "name": row["name"]}
+
 
-                out.append("}")
+def export_response(chunks, file_name: str, mimetype: str) -> Response:
+    """
+    streamed response with the chunks of the exported file
+    """
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{secure_filename(file_name) or "questions"}"'
+        },
+    )
 
-            out.append("<hr>")
 
-    return "<br>".join(out)
+@app.route(f"{app.config['APPLICATION_ROOT']}/export_gift/<course>", methods=["GET"])
+@course_exists
+@check_login
+@is_manager_or_admin
+def export_gift(course: str):
+    """
+    download all questions in GIFT format
+    """
+    return export_response(
+        export.iter_gift(course, iter_course_questions(course)),
+        f"{course}.gift",
+        "text/plain; charset=utf-8",
+    )
+
+
+@app.route(f"{app.config['APPLICATION_ROOT']}/export_xml/<course>", methods=["GET"])
+@course_exists
+@check_login
+@is_manager_or_admin
+def export_xml(course: str):
+    """
+    download all questions in Moodle XML format with the embedded images
+    """
+    return export_response(
+        export.iter_moodle_xml(
+            course, iter_course_questions(course), f"images/{course}"
+        ),
+        f"{course}.xml",
+        "application/xml",
+    )
 
 
 @app.route(
@@ -2721,7 +2857,7 @@ def edit_question(course: str, question_id: int, return_url: str = ""):
 
     if request.method == "GET":
         # get topics
-        with engine.connect() as conn:
+        with db_connection() as conn:
             topics = [
                 row["topic"]
                 for row in conn.execute(
@@ -2735,7 +2871,7 @@ def edit_question(course: str, question_id: int, return_url: str = ""):
             ]
 
         if int(question_id) > 0:
-            with engine.connect() as conn:
+            with db_connection() as conn:
                 question = (
                     conn.execute(
                         text(
@@ -2746,7 +2882,7 @@ def edit_question(course: str, question_id: int, return_url: str = ""):
                     .mappings()
                     .fetchone()
                 )
-            content = json.loads(question["content"])
+            content = load_content(question["content"])
 
             content["answers"] = [
                 x | {"id": f"answer{idx + 1}"}
@@ -2796,7 +2932,7 @@ def edit_question(course: str, question_id: int, return_url: str = ""):
 
     if request.method == "POST":
         if int(question_id) > 0:  # edit question
-            with engine.connect() as conn:
+            with db_connection() as conn:
                 question = (
                     conn.execute(
                         text(
@@ -2807,7 +2943,7 @@ def edit_question(course: str, question_id: int, return_url: str = ""):
                     .mappings()
                     .fetchone()
                 )
-            content = json.loads(question["content"])
+            content = load_content(question["content"])
 
             content["answers"] = [
                 x | {"id": f"answer{idx + 1}"}
@@ -3017,8 +3153,10 @@ def edit_question(course: str, question_id: int, return_url: str = ""):
                     json_file.seek(0)
                     json_file.save(file_path)
 
+        add_html(content)
+
         # save to db
-        with engine.connect() as conn:
+        with db_connection() as conn:
             if int(question_id) > 0:
                 conn.execute(
                     text(
@@ -3046,6 +3184,9 @@ def edit_question(course: str, question_id: int, return_url: str = ""):
                 )
             conn.commit()
 
+        if int(question_id) > 0:
+            invalidate_question(course, question_id)
+
         return redirect(f"/{return_url}")
 
 
@@ -3060,12 +3201,16 @@ def delete_question(course: str, question_id: int):
     """
     set question as deleted
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         conn.execute(
             text("UPDATE questions SET deleted = NOW() WHERE id = :question_id "),
             {"question_id": question_id},
         )
+        scores.rebuild_leaderboard(
+            conn, course, get_course_config(course)["TOPICS_TO_HIDE"]
+        )
         conn.commit()
+    invalidate_question(course, question_id)
     return redirect(request.referrer)
 
 
@@ -3080,12 +3225,16 @@ def undelete_question(course: str, question_id: int):
     """
     set question as not deleted
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         conn.execute(
             text("UPDATE questions SET deleted = NULL WHERE id = :question_id "),
             {"question_id": question_id},
         )
+        scores.rebuild_leaderboard(
+            conn, course, get_course_config(course)["TOPICS_TO_HIDE"]
+        )
         conn.commit()
+    invalidate_question(course, question_id)
     return redirect(request.referrer)
 
 
@@ -3102,10 +3251,10 @@ def bookmarked_questions(course: str):
 
     translation = get_translation("it")
 
-    with engine.connect() as conn:
+    with db_connection() as conn:
         result = conn.execute(
             text(
-                "SELECT questions.id AS id, type, topic, name, content "
+                "SELECT questions.id AS id, type, topic, name, questiontext "
                 "FROM bookmarks, questions "
                 "WHERE bookmarks.question_id = questions.id "
                 "AND nickname = :nickname "
@@ -3115,12 +3264,7 @@ def bookmarked_questions(course: str):
             {"nickname": session["nickname"]},
         )
 
-        questions = result.mappings().all()
-
-    q: list = []
-    for question in questions:
-        content = json.loads(question["content"])
-        q.append(dict(question) | {"questiontext": content["questiontext"]})
+        q = [dict(question) for question in result.mappings().all()]
 
     return render_template(
         "bookmarked_questions.html",
@@ -3143,7 +3287,7 @@ def reset_bookmarked_questions(course: str):
     reset_bookmarked_questions
     """
 
-    with engine.connect() as conn:
+    with db_connection() as conn:
         conn.execute(
             text("DELETE FROM bookmarks WHERE nickname = :nickname "),
             {"nickname": session["nickname"]},
@@ -3189,7 +3333,7 @@ def local_login(course: str):
             return redirect(url_for("home", course=course))
 
         password_hash = hashlib.sha256(form_data.get("password").encode()).hexdigest()
-        with engine.connect() as conn:
+        with db_connection() as conn:
             cursor = conn.execute(
                 text(
                     "SELECT id FROM users WHERE nickname = :nickname AND password_hash = :password_hash"
@@ -3204,7 +3348,7 @@ def local_login(course: str):
                 session["nickname"] = form_data.get("nickname")
                 session["user_id"] = row["id"]
                 # check if manager
-                with engine.connect() as conn:
+                with db_connection() as conn:
                     flag_manager = conn.execute(
                         text(
                             "SELECT COUNT(*) FROM courses WHERE name = :course AND :nickname = ANY(managers)"
@@ -3285,7 +3429,7 @@ def new_course():
             return render_template("new_course.html")
 
         # check if course exists
-        with engine.connect() as conn:
+        with db_connection() as conn:
             # check if course exists
             n_courses = conn.execute(
                 text("SELECT count(*) FROM courses WHERE name = :course"),
@@ -3328,7 +3472,7 @@ def new_course():
                 )
                 return redirect(url_for("main_home"))
 
-        with engine.connect() as conn:
+        with db_connection() as conn:
             conn.execute(
                 text(
                     "UPDATE courses SET "
@@ -3370,6 +3514,17 @@ def new_course():
             )
             conn.commit()
 
+        invalidate_course_config(request.form["course_name"])
+
+        # the hidden topics or the managers may have changed
+        with db_connection() as conn:
+            scores.rebuild_leaderboard(
+                conn,
+                request.form["course_name"],
+                get_course_config(request.form["course_name"])["TOPICS_TO_HIDE"],
+            )
+            conn.commit()
+
         return redirect(
             url_for("course_management", course=request.form["course_name"])
         )
@@ -3417,7 +3572,7 @@ def new_nickname(course: str):
 
         password_hash = hashlib.sha256(password1.encode()).hexdigest()
 
-        with engine.connect() as conn:
+        with db_connection() as conn:
             n_users = conn.execute(
                 text(
                     "SELECT COUNT(*) AS n_users FROM users WHERE nickname = :nickname"
@@ -3480,7 +3635,8 @@ def delete_nickname(course: str):
     """
     delete nickname and all correlated data
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
+        scores.forget_user(conn, session["user_id"])
         conn.execute(
             text("DELETE FROM results WHERE user_id = :user_id"),
             {"user_id": session["user_id"]},
@@ -3520,7 +3676,8 @@ def delete_data(course: str):
     """
     config = get_course_config(course)
 
-    with engine.connect() as conn:
+    with db_connection() as conn:
+        scores.forget_user(conn, session["user_id"], course)
         conn.execute(
             text("DELETE FROM results WHERE course = :course AND user_id = :user_id"),
             {"user_id": session["user_id"], "course": course},
@@ -3556,10 +3713,194 @@ def delete_data(course: str):
     return redirect(url_for("home", course=course))
 
 
+@app.route(f"{app.config['APPLICATION_ROOT']}/stats")
+@is_admin
+def stats():
+    """
+    internal counters (caches, connection pool, SQL instrumentation)
+    """
+    return jsonify(
+        {
+            "course_config_cache": course_config_cache.stats(),
+            "question_cache": question_cache.stats(),
+            "dashboard_single_flight": dashboard_single_flight.stats(),
+            "result_writer": write_behind.stats() if write_behind is not None else None,
+            "connection_pool": db.pool_stats(),
+            "sql_flagged_endpoints": sql_stats.flagged_endpoints,
+        }
+    )
+
+
 @app.route(f"{app.config['APPLICATION_ROOT']}/version")
 def version():
     return f"v. {__version__}<br>date: {__version_date__}"
 
 
+@app.cli.command("rebuild-question-stats")
+@click.option("--course", default=None, help="course to rebuild (default: all courses)")
+@click.option(
+    "--check", is_flag=True, help="only count the rows that differ from results"
+)
+def rebuild_question_stats(course: str | None, check: bool):
+    """
+    recompute the user_question_stats and question_stats tables from the results
+    """
+    with db_connection() as conn:
+        n_differences = scores.check_user_question_stats(conn, course)
+        click.echo(f"{n_differences} rows of user_question_stats differ from results")
+        if check:
+            return
+        n_rows = scores.rebuild_user_question_stats(conn, course)
+        n_questions = scores.rebuild_question_stats(conn, course)
+        conn.commit()
+    click.echo(f"user_question_stats rebuilt: {n_rows} rows")
+    click.echo(
+        f"question_stats rebuilt: {n_questions} rows (run refresh-item-analysis)"
+    )
+
+
+@app.cli.command("refresh-item-analysis")
+@click.option("--course", default=None, help="course to analyse (default: all courses)")
+def refresh_item_analysis(course: str | None):
+    """
+    compute the p-value and the discrimination of the questions in question_stats
+    (can be scheduled, e.g. nightly)
+    """
+    with db_connection() as conn:
+        courses = (
+            [course]
+            if course is not None
+            else conn.execute(text("SELECT name FROM courses")).scalars().all()
+        )
+        for course_name in courses:
+            n_questions = scores.refresh_item_analysis(conn, course_name)
+            click.echo(f"{course_name}: {n_questions} questions analysed")
+        conn.commit()
+
+
+@app.cli.command("rebuild-leaderboard")
+@click.option("--course", default=None, help="course to rebuild (default: all courses)")
+def rebuild_leaderboard(course: str | None):
+    """
+    recompute the leaderboard from user_question_stats
+    (can be scheduled to refresh the scores after modifications of the questions)
+    """
+    with db_connection() as conn:
+        courses = (
+            [course]
+            if course is not None
+            else conn.execute(text("SELECT name FROM courses")).scalars().all()
+        )
+        for course_name in courses:
+            n_users = scores.rebuild_leaderboard(
+                conn, course_name, get_course_config(course_name)["TOPICS_TO_HIDE"]
+            )
+            click.echo(f"{course_name}: {n_users} users ranked")
+        conn.commit()
+
+
+@app.cli.command("rebuild-course-rollups")
+@click.option("--course", default=None, help="course to rebuild (default: all courses)")
+def rebuild_course_rollups(course: str | None):
+    """
+    recompute the hourly rollups of the course dashboard from the results
+    """
+    with db_connection() as conn:
+        scores.rebuild_course_rollups(conn, course)
+        conn.commit()
+    click.echo("course rollups rebuilt")
+
+
+@app.cli.command("create-results-partitions")
+@click.option(
+    "--months",
+    default=3,
+    show_default=True,
+    help="number of months after the current one",
+)
+def create_results_partitions(months: int):
+    """
+    create the monthly partitions of the results table (can be scheduled monthly)
+    the rows recorded in the default partition are moved to their monthly partition
+    """
+    with db_connection() as conn:
+        partitions = results_archive.create_results_partitions(conn, months)
+        conn.commit()
+    click.echo(f"partitions: {', '.join(partitions)}")
+
+
+@app.cli.command("archive-results")
+@click.option(
+    "--retention-months",
+    default=None,
+    type=int,
+    help="months of results to keep (default: RESULTS_RETENTION_MONTHS or 24)",
+)
+def archive_results(retention_months: int | None):
+    """
+    archive the expired partitions of the results table in gzipped CSV files
+    (RESULTS_ARCHIVE_PATH, default archive) and drop them
+    """
+    if retention_months is None:
+        retention_months = app.config.get("RESULTS_RETENTION_MONTHS", 24)
+    with db_connection() as conn:
+        archived = results_archive.archive_results_partitions(
+            conn, retention_months, app.config.get("RESULTS_ARCHIVE_PATH", "archive")
+        )
+        default_months = results_archive.default_partition_months(conn)
+    for file_path in archived:
+        click.echo(f"{file_path} archived")
+    click.echo(f"{len(archived)} partitions archived")
+    if default_months:
+        click.echo(
+            "rows left in results_default (run create-results-partitions): "
+            + ", ".join(month.strftime("%Y-%m") for month in default_months)
+        )
+
+
+@app.cli.command("export-results")
+@click.option("--course", default=None, help="course to export (default: all courses)")
+@click.option(
+    "--start", default=None, type=click.DateTime(["%Y-%m-%d"]), help="first day"
+)
+@click.option(
+    "--end", default=None, type=click.DateTime(["%Y-%m-%d"]), help="day after the last"
+)
+@click.option("--output", type=click.File("w"), default="-", help="CSV file")
+def export_results(course, start, end, output):
+    """
+    export the results (archived and in database) in CSV
+    """
+    start = start.date() if start else None
+    end = end.date() if end else None
+
+    def database_results():
+        with db_connection() as conn:
+            rows = conn.execute(
+                text(
+                    f"SELECT {', '.join(results_archive.RESULTS_COLUMNS)} FROM results "
+                    "WHERE (CAST(:course AS TEXT) IS NULL OR course = :course) "
+                    "AND (CAST(:start AS DATE) IS NULL OR timestamp >= :start) "
+                    "AND (CAST(:end AS DATE) IS NULL OR timestamp < :end) "
+                    "ORDER BY id"
+                ),
+                {"course": course, "start": start, "end": end},
+                execution_options={
+                    "stream_results": True,
+                    "yield_per": app.config.get("EXPORT_YIELD_PER", 500),
+                },
+            ).mappings()
+            yield from rows
+
+    rows = itertools.chain(
+        results_archive.iter_archived_results(
+            app.config.get("RESULTS_ARCHIVE_PATH", "archive"), course, start, end
+        ),
+        database_results(),
+    )
+    for chunk in results_archive.iter_results_csv(rows):
+        output.write(chunk)
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5001)
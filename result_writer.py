@@ -0,0 +1,361 @@
+"""
+write-behind recording of the results
+
+the results are queued in process and written in batches by a background thread
+every flush_interval seconds or when max_rows results are queued
+
+each queued result is first appended to a spill file (one JSON line by result)
+of spill_dir: the spill files of a batch are deleted when the batch is committed
+and the spill files left by a crashed process are written again by recover
+(a result can be written twice if the process crashes between the commit and the deletion)
+
+durability: with fsync (default) each result is on disk (os.fsync) before submit returns,
+the spill files survive a crash of the host; without fsync they only survive
+a crash of the process
+
+after a failed batch the results are written one by one: the results still rejected
+(e.g. a question deleted by a full import while its answers were queued) are appended
+with the error to the dead-letter file of spill_dir (dead_letter.jsonl), as the oldest
+results when more than max_queue results are queued;
+when the database is unavailable (TEMPORARY_ERRORS) the results stay in the queue
+
+the timestamps of the results are set in UTC by submit and converted by the database
+in its time zone (see scores.record_results), as CURRENT_TIMESTAMP
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+# errors of the database (connection, pool, deadlock), the results are written again later
+TEMPORARY_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+
+
+class ResultWriter:
+    """
+    queue of results written in batches by write_rows(rows) in a background thread
+    """
+
+    def __init__(
+        self,
+        write_rows: Callable[[list[dict]], None],
+        spill_dir: str,
+        flush_interval: float = 0.2,
+        max_rows: int = 500,
+        max_queue: int = 100_000,
+        fsync: bool = True,
+    ):
+        self.write_rows = write_rows
+        self.spill_dir = Path(spill_dir)
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.max_queue = max_queue
+        self.fsync = fsync
+
+        self._init_state()
+        # the thread is started in each process (see start)
+        self._pid = None
+        self._stopped = False
+
+        atexit.register(self.close)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _init_state(self) -> None:
+        self._rows: list = []
+        # spill files of the queued rows
+        self._segments: list = []
+        self._spill_file = None
+        self._sequence: int = 0
+        self._lock = threading.Lock()
+        # only one flush at a time
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        # spill files to recover again (database unavailable)
+        self._recovery_pending = True
+
+        self.submitted: int = 0
+        self.written: int = 0
+        self.dead_letters: int = 0
+        self.flushes: int = 0
+        self.failures: int = 0
+        self.flush_time: float = 0
+        self.max_flush_time: float = 0
+        self.last_flush_time: float = 0
+
+    def _after_fork(self) -> None:
+        """
+        the queue, the locks and the thread of the parent are not used in the child:
+        the writer is started again in the worker
+        """
+        started = self._pid is not None
+        self._init_state()
+        self._pid = None
+        if started and not self._stopped:
+            self.start()
+
+    def _spill_path(self, suffix: str) -> Path:
+        return self.spill_dir / f"results-{os.getpid()}-{suffix}.jsonl"
+
+    def _recovering_path(self) -> Path:
+        return self.spill_dir / f"recovering-{os.getpid()}-{time.time_ns()}.jsonl"
+
+    def _sync(self, f) -> None:
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def _sync_dir(self) -> None:
+        if self.fsync:
+            fd = os.open(self.spill_dir, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def start(self) -> None:
+        """
+        start the background thread of the current process (at the start of the worker),
+        the spill files left by stopped processes are recovered by the thread
+        """
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            # spill files left by a previous process with the same pid
+            for spill_path in self.spill_dir.glob(f"results-{os.getpid()}-*.jsonl"):
+                os.replace(spill_path, self._recovering_path())
+            threading.Thread(
+                target=self._run, name="result-writer", daemon=True
+            ).start()
+
+    def submit(self, row: dict) -> None:
+        """
+        queue a result (dict for scores.record_results)
+        the timestamp of the answer (UTC) is set if missing
+        """
+        self.start()
+        row = {"timestamp": datetime.now(timezone.utc).isoformat(sep=" "), **row}
+        with self._lock:
+            if self._spill_file is None:
+                self._spill_file = open(self._spill_path("current"), "a")
+                self._sync_dir()
+            self._spill_file.write(json.dumps(row) + "\n")
+            self._sync(self._spill_file)
+            self._rows.append(row)
+            self.submitted += 1
+            self._trim_queue()
+            if len(self._rows) >= self.max_rows:
+                self._wake.set()
+
+    def _trim_queue(self) -> None:
+        """
+        move the oldest results to the dead-letter file if the queue is full
+        (called with self._lock)
+        """
+        if len(self._rows) > self.max_queue:
+            overflow = self._rows[: len(self._rows) - self.max_queue]
+            del self._rows[: len(overflow)]
+            self._dead_letter(overflow, "queue full")
+
+    def _dead_letter(self, rows: list[dict], error) -> None:
+        logging.error(
+            f"result writer: {len(rows)} results moved to {DEAD_LETTER_FILE}: {error}"
+        )
+        with open(self.spill_dir / DEAD_LETTER_FILE, "a") as f_out:
+            for row in rows:
+                f_out.write(json.dumps({"error": str(error), "row": row}) + "\n")
+            self._sync(f_out)
+        self.dead_letters += len(rows)
+
+    def _write(self, rows: list[dict]) -> list[dict]:
+        """
+        write rows, one by one after a failed batch,
+        the rows rejected by the database are moved to the dead-letter file
+
+        returns the rows not written because of a temporary error
+        """
+        try:
+            self.write_rows(rows)
+            with self._lock:
+                self.written += len(rows)
+            return []
+        except TEMPORARY_ERRORS:
+            logging.exception("result writer: results not written")
+            return rows
+        except Exception as e:
+            if len(rows) == 1:
+                with self._lock:
+                    self._dead_letter(rows, e)
+                return []
+
+        for idx, row in enumerate(rows):
+            if self._write([row]):
+                return rows[idx:]
+        return []
+
+    def _run(self) -> None:
+        while not self._stopped:
+            if self._recovery_pending:
+                self.recover()
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("result writer: flush failed")
+
+    def flush(self) -> int:
+        """
+        write the queued results
+        on temporary errors the results stay in the queue for the next flush
+
+        returns the number of written results
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._spill_file is not None:
+                    self._spill_file.close()
+                    self._spill_file = None
+                    self._sequence += 1
+                    segment = self._spill_path(str(self._sequence))
+                    os.replace(self._spill_path("current"), segment)
+                    self._segments.append(segment)
+                rows, self._rows = self._rows, []
+                segments = list(self._segments)
+            if not rows:
+                return 0
+
+            start = time.perf_counter()
+            n_written = self.written
+            not_written = self._write(rows)
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.flushes += 1
+                self.flush_time += elapsed
+                self.last_flush_time = elapsed
+                self.max_flush_time = max(self.max_flush_time, elapsed)
+                if not_written:
+                    # the spill files are kept until the results are written
+                    self.failures += 1
+                    self._rows = not_written + self._rows
+                    self._trim_queue()
+                    return self.written - n_written
+                self._segments = [s for s in self._segments if s not in segments]
+            for segment in segments:
+                segment.unlink(missing_ok=True)
+            return self.written - n_written
+
+    def close(self) -> None:
+        """
+        stop the background thread and write the queued results
+        (at the exit of the worker)
+        """
+        self._stopped = True
+        self._wake.set()
+        self.flush()
+        if self._rows:
+            logging.error(
+                f"result writer: {len(self._rows)} results not written, kept in {self.spill_dir}"
+            )
+
+    def recover(self) -> int:
+        """
+        write the results of the spill files left by the processes that are not running
+        (called by the background thread until all the files are recovered)
+        a file that cannot be written (database unavailable) is kept for the next call
+
+        returns the number of written results
+        """
+        if not self.spill_dir.is_dir():
+            self._recovery_pending = False
+            return 0
+        n_written = self.written
+        pending = False
+        for spill_path in sorted(
+            [
+                *self.spill_dir.glob("results-*.jsonl"),
+                *self.spill_dir.glob("recovering-*.jsonl"),
+            ]
+        ):
+            try:
+                pid = int(spill_path.name.split("-")[1])
+            except (IndexError, ValueError):
+                continue
+            if pid == os.getpid():
+                # spill files of this process are written by flush
+                if spill_path.name.startswith("results-"):
+                    continue
+                recovering_path = spill_path
+            else:
+                if pid_running(pid):
+                    continue
+                # only one process recovers a file
+                recovering_path = self._recovering_path()
+                try:
+                    os.replace(spill_path, recovering_path)
+                except FileNotFoundError:
+                    continue
+
+            try:
+                with open(recovering_path) as f_in:
+                    rows = [json.loads(line) for line in f_in if line.strip()]
+            except (OSError, ValueError):
+                logging.exception(f"result writer: {recovering_path} cannot be read")
+                continue
+            not_written = self._write(rows) if rows else []
+            if not_written:
+                # the remaining results are recovered at the next call
+                tmp_path = recovering_path.with_suffix(".tmp")
+                with open(tmp_path, "w") as f_out:
+                    for row in not_written:
+                        f_out.write(json.dumps(row) + "\n")
+                    self._sync(f_out)
+                os.replace(tmp_path, recovering_path)
+                pending = True
+                continue
+            recovering_path.unlink()
+            logging.info(
+                f"result writer: {len(rows)} results recovered from {spill_path}"
+            )
+
+        self._recovery_pending = pending
+        return self.written - n_written
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": len(self._rows),
+                "submitted": self.submitted,
+                "written": self.written,
+                "dead_letters": self.dead_letters,
+                "flushes": self.flushes,
+                "failures": self.failures,
+                "mean_flush_ms": round(1000 * self.flush_time / self.flushes, 2)
+                if self.flushes
+                else 0,
+                "last_flush_ms": round(1000 * self.last_flush_time, 2),
+                "max_flush_ms": round(1000 * self.max_flush_time, 2),
+            }
+
+
+def pid_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,229 @@
+"""
+monthly partitions of the results table: creation, archival and export of the archives
+
+an archived partition is copied in a gzipped CSV file (results_YYYY_MM.csv.gz)
+of the archive directory, then detached and dropped
+the rows of the default partition (results_default, months without partition)
+are moved to their monthly partition before the archival
+the statistics tables (user_question_stats, question_stats, leaderboard, hourly rollups)
+keep the archived answers; their counts by course, user and question are saved
+in archived_results_stats and added to the remaining results by the rebuilds
+(see scores.USER_QUESTION_STATS_QUERY), the rollups of the archived months are kept
+"""
+
+import csv
+import datetime as dt
+import gzip
+import io
+from pathlib import Path
+from typing import Iterator
+
+from sqlalchemy import text
+
+PARTITION_PREFIX = "results_"
+ARCHIVE_SUFFIX = ".csv.gz"
+RESULTS_COLUMNS = (
+    "id",
+    "course",
+    "timestamp",
+    "user_id",
+    "question_id",
+    "topic",
+    "question_type",
+    "question_name",
+    "good_answer",
+)
+
+
+def add_months(month: dt.date, n: int) -> dt.date:
+    """
+    first day of the month n months after month
+    """
+    index = month.year * 12 + month.month - 1 + n
+    return dt.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_month(partition_name: str) -> dt.date | None:
+    """
+    month of a partition (results_YYYY_MM or results_YYYY_MM.csv.gz), None for other names
+    """
+    try:
+        return dt.datetime.strptime(
+            partition_name.removesuffix(ARCHIVE_SUFFIX), f"{PARTITION_PREFIX}%Y_%m"
+        ).date()
+    except ValueError:
+        return None
+
+
+def default_partition_months(conn) -> list[dt.date]:
+    """
+    returns the months of the rows of the default partition (results_default),
+    i.e. the rows recorded while their monthly partition did not exist
+    """
+    return (
+        conn.execute(
+            text(
+                "SELECT DISTINCT CAST(date_trunc('month', timestamp) AS DATE) "
+                "FROM results_default ORDER BY 1"
+            )
+        )
+        .scalars()
+        .all()
+    )
+
+
+def create_results_partitions(conn, n_months: int) -> list[str]:
+    """
+    create the partitions of the current month, of the next n_months and of the months
+    of the rows of the default partition (if they do not exist) in the transaction of conn
+    (the caller must commit)
+    the rows of the default partition are moved to their partition (see create_results_partition)
+
+    returns the names of the partitions
+    """
+    current_month = dt.date.today().replace(day=1)
+    months = {add_months(current_month, n) for n in range(n_months + 1)}
+    months.update(default_partition_months(conn))
+    return [
+        conn.execute(
+            text("SELECT create_results_partition(:month)"), {"month": month}
+        ).scalar()
+        for month in sorted(months)
+    ]
+
+
+def list_results_partitions(conn) -> list[tuple[str, dt.date]]:
+    """
+    returns the monthly partitions of results (name, month) ordered by month
+    """
+    names = (
+        conn.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = CAST('results' AS regclass)"
+            )
+        )
+        .scalars()
+        .all()
+    )
+    return sorted(
+        ((name, month) for name in names if (month := partition_month(name))),
+        key=lambda x: x[1],
+    )
+
+
+def archive_results_partitions(
+    conn, retention_months: int, archive_path: str
+) -> list[Path]:
+    """
+    archive the partitions of results older than retention_months (the current month excluded)
+    in gzipped CSV files of archive_path, save their counts in archived_results_stats,
+    then detach and drop them
+    each partition is archived and dropped in its own transaction
+    the rows of the default partition are first moved to their monthly partition
+
+    returns the paths of the archive files
+    """
+    limit = add_months(dt.date.today().replace(day=1), -retention_months)
+    Path(archive_path).mkdir(parents=True, exist_ok=True)
+
+    for month in default_partition_months(conn):
+        conn.execute(text("SELECT create_results_partition(:month)"), {"month": month})
+    conn.commit()
+
+    archived: list = []
+    for partition_name, month in list_results_partitions(conn):
+        if month >= limit:
+            break
+        file_path = Path(archive_path) / f"{partition_name}{ARCHIVE_SUFFIX}"
+        if file_path.exists():
+            raise FileExistsError(f"{file_path} already exists")
+
+        # the file is renamed when complete
+        tmp_path = file_path.with_name(f"{file_path.name}.tmp")
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8", newline="") as f_out:
+                cursor.copy_expert(
+                    f"COPY (SELECT {', '.join(RESULTS_COLUMNS)} FROM {partition_name} ORDER BY id) "
+                    "TO STDOUT WITH (FORMAT csv, HEADER)",
+                    f_out,
+                )
+        finally:
+            cursor.close()
+        tmp_path.rename(file_path)
+
+        # the answers are kept for the rebuilds of the statistics
+        conn.execute(
+            text(
+                "INSERT INTO archived_results_stats (month, course, user_id, question_id, "
+                "topic, question_type, question_name, n_ok, n_no, last_answer) "
+                "SELECT :month, course, user_id, question_id, topic, question_type, question_name, "
+                "COUNT(*) FILTER (WHERE good_answer), COUNT(*) FILTER (WHERE NOT good_answer), "
+                "MAX(timestamp) "
+                f"FROM {partition_name} "
+                "GROUP BY course, user_id, question_id, topic, question_type, question_name"
+            ),
+            {"month": month},
+        )
+        # the rows are not deleted: the triggers of the rollups are not fired
+        conn.execute(text(f"ALTER TABLE results DETACH PARTITION {partition_name}"))
+        conn.execute(text(f"DROP TABLE {partition_name}"))
+        conn.commit()
+        archived.append(file_path)
+
+    return archived
+
+
+def iter_archived_results(
+    archive_path: str,
+    course: str | None = None,
+    start: dt.date | None = None,
+    end: dt.date | None = None,
+) -> Iterator[dict]:
+    """
+    yield the archived results (dicts of strings, as in the CSV files)
+    of course (all courses if None) between start (included) and end (excluded)
+    only the files of the matching months are read
+    """
+    for file_path in sorted(
+        Path(archive_path).glob(f"{PARTITION_PREFIX}*{ARCHIVE_SUFFIX}")
+    ):
+        month = partition_month(file_path.name)
+        if month is None:
+            continue
+        if start is not None and add_months(month, 1) <= start:
+            continue
+        if end is not None and month >= end:
+            continue
+        with gzip.open(file_path, "rt", encoding="utf-8", newline="") as f_in:
+            for row in csv.DictReader(f_in):
+                if course is not None and row["course"] != course:
+                    continue
+                if start is not None and row["timestamp"] < start.isoformat():
+                    continue
+                if end is not None and row["timestamp"] >= end.isoformat():
+                    continue
+                yield row
+
+
+def iter_results_csv(rows: Iterator[dict]) -> Iterator[str]:
+    """
+    yield the results (dicts) as CSV lines with header
+    booleans are written as t/f like COPY
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=RESULTS_COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(
+            {
+                key: ("t" if value else "f") if isinstance(value, bool) else value
+                for key, value in row.items()
+            }
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,611 @@
+"""
+recording of the answers and precomputed statistics
+
+user_question_stats keeps the number of good and wrong answers of each user to each question,
+it is updated with the results in the same transaction
+
+question_stats keeps the number of answers and good answers of each question (admin excluded),
+it is updated with the results; p_value and discrimination (item analysis) are refreshed
+on demand by refresh_item_analysis
+
+leaderboard keeps the score of each user of a course, it is updated after each answer
+and rebuilt when the questions or the hidden topics change
+
+course_hourly_stats and course_hourly_users are hourly rollups of the results
+for the course dashboard, maintained by triggers on results
+
+the answers of the archived partitions of results are kept in archived_results_stats
+and added to the results by the rebuilds (see results_archive)
+"""
+
+from collections import defaultdict
+from typing import Iterable
+
+import numpy as np
+from sqlalchemy import text
+
+import quiz
+
+# statistics computed from the results table and from the answers of the archived
+# partitions (archived_results_stats, see results_archive.archive_results_partitions)
+USER_QUESTION_STATS_QUERY = (
+    "SELECT course, user_id, question_id, "
+    "CAST(SUM(n_ok) AS INTEGER) AS n_ok, CAST(SUM(n_no) AS INTEGER) AS n_no, "
+    "MAX(last_answer) AS last_answer "
+    "FROM ("
+    "    SELECT course, user_id, question_id, "
+    "    COUNT(*) FILTER (WHERE good_answer) AS n_ok, "
+    "    COUNT(*) FILTER (WHERE NOT good_answer) AS n_no, "
+    "    MAX(timestamp) AS last_answer "
+    "    FROM results "
+    "    WHERE question_id IS NOT NULL {where} "
+    "    GROUP BY course, user_id, question_id "
+    "    UNION ALL "
+    "    SELECT course, user_id, question_id, n_ok, n_no, last_answer "
+    "    FROM archived_results_stats "
+    "    WHERE question_id IS NOT NULL {where}"
+    ") AS answers "
+    "GROUP BY course, user_id, question_id"
+)
+
+QUESTION_STATS_QUERY = (
+    "SELECT question_id, MIN(course), CAST(SUM(n_answers) AS INTEGER), "
+    "CAST(SUM(n_ok) AS INTEGER), MAX(last_answer) "
+    "FROM ("
+    "    SELECT question_id, MIN(course) AS course, COUNT(*) AS n_answers, "
+    "    COUNT(*) FILTER (WHERE good_answer) AS n_ok, MAX(timestamp) AS last_answer "
+    "    FROM results "
+    "    WHERE question_id IS NOT NULL AND user_id <> 0 {where} "
+    "    GROUP BY question_id "
+    "    UNION ALL "
+    "    SELECT question_id, course, n_ok + n_no, n_ok, last_answer "
+    "    FROM archived_results_stats "
+    "    WHERE question_id IS NOT NULL AND user_id <> 0 {where}"
+    ") AS answers "
+    "GROUP BY question_id"
+)
+
+
+# users of :user_ids not ranked in the leaderboard of :course:
+# admin (user_id 0), the admin and manager accounts and the managers of the course
+NOT_RANKED_USERS = (
+    "SELECT 0 UNION ALL "
+    "SELECT x.id FROM users x JOIN courses c ON c.name = :course "
+    "WHERE x.id = ANY(:user_ids) AND (x.nickname IN ('admin', 'manager') "
+    "OR x.nickname = ANY(c.managers) OR COALESCE(x.email = ANY(c.managers), FALSE))"
+)
+
+
+def record_results(conn, rows: Iterable[dict]) -> int:
+    """
+    insert the results (dicts with course, user_id, question_id, topic, question_type,
+    question_name, good_answer and optionally timestamp) and update user_question_stats
+    and question_stats in the transaction of conn (the caller must commit)
+    a timestamp with time zone (e.g. UTC) is converted in the time zone of the database
+    session, like the default CURRENT_TIMESTAMP
+
+    returns the number of recorded results
+    """
+    rows = [{"timestamp": None, **row} for row in rows]
+    if not rows:
+        return 0
+
+    conn.execute(
+        text(
+            "INSERT INTO results (course, timestamp, user_id, question_id, topic, question_type, question_name, good_answer) "
+            "VALUES (:course, COALESCE(CAST(:timestamp AS TIMESTAMPTZ), CURRENT_TIMESTAMP), "
+            ":user_id, :question_id, :topic, :question_type, :question_name, :good_answer)"
+        ),
+        rows,
+    )
+
+    # one upsert by (course, user, question)
+    counters: dict = defaultdict(lambda: {"n_ok": 0, "n_no": 0, "timestamp": None})
+    for row in rows:
+        if row["question_id"] is None:
+            continue
+        counter = counters[(row["course"], row["user_id"], row["question_id"])]
+        counter["n_ok" if row["good_answer"] else "n_no"] += 1
+        if row["timestamp"] is not None and (
+            counter["timestamp"] is None or row["timestamp"] > counter["timestamp"]
+        ):
+            counter["timestamp"] = row["timestamp"]
+
+    if counters:
+        conn.execute(
+            text(
+                "INSERT INTO user_question_stats (course, user_id, question_id, n_ok, n_no, last_answer) "
+                "VALUES (:course, :user_id, :question_id, :n_ok, :n_no, "
+                "COALESCE(CAST(:timestamp AS TIMESTAMPTZ), CURRENT_TIMESTAMP)) "
+                "ON CONFLICT (course, user_id, question_id) DO UPDATE SET "
+                "n_ok = user_question_stats.n_ok + EXCLUDED.n_ok, "
+                "n_no = user_question_stats.n_no + EXCLUDED.n_no, "
+                "last_answer = GREATEST(user_question_stats.last_answer, EXCLUDED.last_answer)"
+            ),
+            [
+                {
+                    "course": course,
+                    "user_id": user_id,
+                    "question_id": question_id,
+                    **counter,
+                }
+                for (course, user_id, question_id), counter in counters.items()
+            ],
+        )
+
+    # one upsert by question (admin excluded)
+    question_counters: dict = defaultdict(
+        lambda: {"n_answers": 0, "n_ok": 0, "timestamp": None}
+    )
+    for (course, user_id, question_id), counter in counters.items():
+        if user_id == 0:
+            continue
+        question_counter = question_counters[(course, question_id)]
+        question_counter["n_answers"] += counter["n_ok"] + counter["n_no"]
+        question_counter["n_ok"] += counter["n_ok"]
+        if counter["timestamp"] is not None and (
+            question_counter["timestamp"] is None
+            or counter["timestamp"] > question_counter["timestamp"]
+        ):
+            question_counter["timestamp"] = counter["timestamp"]
+
+    if question_counters:
+        conn.execute(
+            text(
+                "INSERT INTO question_stats (question_id, course, n_answers, n_ok, last_answered) "
+                "VALUES (:question_id, :course, :n_answers, :n_ok, "
+                "COALESCE(CAST(:timestamp AS TIMESTAMPTZ), CURRENT_TIMESTAMP)) "
+                "ON CONFLICT (question_id) DO UPDATE SET "
+                "n_answers = question_stats.n_answers + EXCLUDED.n_answers, "
+                "n_ok = question_stats.n_ok + EXCLUDED.n_ok, "
+                "last_answered = GREATEST(question_stats.last_answered, EXCLUDED.last_answered)"
+            ),
+            [
+                {"course": course, "question_id": question_id, **counter}
+                for (course, question_id), counter in question_counters.items()
+            ],
+        )
+
+    return len(rows)
+
+
+def check_user_question_stats(conn, course: str | None = None) -> int:
+    """
+    returns the number of rows of user_question_stats that differ from the results
+    """
+    where = "AND course = :course" if course is not None else ""
+    return conn.execute(
+        text(
+            "SELECT COUNT(*) FROM ("
+            f"    ({USER_QUESTION_STATS_QUERY.format(where=where)} "
+            "     EXCEPT SELECT course, user_id, question_id, n_ok, n_no, last_answer "
+            f"    FROM user_question_stats WHERE TRUE {where}) "
+            "    UNION ALL "
+            "    (SELECT course, user_id, question_id, n_ok, n_no, last_answer "
+            f"    FROM user_question_stats WHERE TRUE {where} "
+            f"     EXCEPT {USER_QUESTION_STATS_QUERY.format(where=where)})"
+            ") AS differences"
+        ),
+        {"course": course},
+    ).scalar()
+
+
+def rebuild_user_question_stats(conn, course: str | None = None) -> int:
+    """
+    recompute user_question_stats from the results (of course or of all courses)
+    in the transaction of conn (the caller must commit)
+
+    returns the number of rows of the rebuilt table
+    """
+    where = "AND course = :course" if course is not None else ""
+    conn.execute(
+        text(f"DELETE FROM user_question_stats WHERE TRUE {where}"),
+        {"course": course},
+    )
+    return conn.execute(
+        text(
+            "INSERT INTO user_question_stats (course, user_id, question_id, n_ok, n_no, last_answer) "
+            f"{USER_QUESTION_STATS_QUERY.format(where=where)}"
+        ),
+        {"course": course},
+    ).rowcount
+
+
+def rebuild_question_stats(conn, course: str | None = None) -> int:
+    """
+    recompute the counters of question_stats from the results (of course or of all courses)
+    in the transaction of conn (the caller must commit)
+    the item analysis must be refreshed afterwards (see refresh_item_analysis)
+
+    returns the number of rows of the rebuilt table
+    """
+    where = "AND course = :course" if course is not None else ""
+    conn.execute(
+        text(f"DELETE FROM question_stats WHERE TRUE {where}"),
+        {"course": course},
+    )
+    return conn.execute(
+        text(
+            "INSERT INTO question_stats (question_id, course, n_answers, n_ok, last_answered) "
+            f"{QUESTION_STATS_QUERY.format(where=where)}"
+        ),
+        {"course": course},
+    ).rowcount
+
+
+def forget_user(conn, user_id: int, course: str | None = None) -> None:
+    """
+    remove the answers of user_id (in course or in all courses) from the statistics
+    (archived answers included)
+    in the transaction of conn (the caller must commit and delete the results)
+    """
+    where = "AND s.course = :course" if course is not None else ""
+    parameters = {"user_id": user_id, "course": course}
+    if user_id != 0:
+        conn.execute(
+            text(
+                "UPDATE question_stats q SET "
+                "n_answers = q.n_answers - s.n_ok - s.n_no, n_ok = q.n_ok - s.n_ok "
+                "FROM user_question_stats s "
+                f"WHERE s.question_id = q.question_id AND s.user_id = :user_id {where}"
+            ),
+            parameters,
+        )
+    for table in ("user_question_stats", "leaderboard", "archived_results_stats"):
+        conn.execute(
+            text(f"DELETE FROM {table} s WHERE s.user_id = :user_id {where}"),
+            parameters,
+        )
+
+
+def refresh_item_analysis(conn, course: str) -> int:
+    """
+    compute the p-value and the discrimination of the questions of course
+    (by topic, from the success rates of user_question_stats, admin excluded, see quiz.item_analysis)
+    and save them in question_stats in the transaction of conn (the caller must commit)
+    the analysis of the questions not analysed in this run (deleted, without answers,
+    too few answers) is reset to NULL
+
+    returns the number of analysed questions
+    """
+    conn.execute(
+        text(
+            "UPDATE question_stats SET p_value = NULL, discrimination = NULL, "
+            "analysis_updated = NULL WHERE course = :course"
+        ),
+        {"course": course},
+    )
+    rows = conn.execute(
+        text(
+            "SELECT q.topic, s.user_id, s.question_id, "
+            "CAST(s.n_ok AS FLOAT) / (s.n_ok + s.n_no) AS success_rate "
+            "FROM user_question_stats s JOIN questions q ON q.id = s.question_id "
+            "WHERE s.course = :course AND s.user_id <> 0 AND q.deleted IS NULL "
+            "AND s.n_ok + s.n_no > 0 "
+            "ORDER BY q.topic"
+        ),
+        {"course": course},
+    ).all()
+    if not rows:
+        return 0
+
+    topics = np.array([row.topic for row in rows], dtype=object)
+    user_ids = np.array([row.user_id for row in rows])
+    question_ids = np.array([row.question_id for row in rows])
+    success_rates = np.array([row.success_rate for row in rows], dtype=float)
+
+    analysis: list = []
+    # rows are ordered by topic
+    boundaries = np.flatnonzero(topics[1:] != topics[:-1]) + 1
+    for idx in np.split(np.arange(len(rows)), boundaries):
+        questions, p_values, discrimination = quiz.item_analysis(
+            user_ids[idx], question_ids[idx], success_rates[idx]
+        )
+        analysis.extend(
+            {
+                "question_id": int(question_id),
+                "p_value": float(p_value),
+                "discrimination": None if np.isnan(d) else float(d),
+            }
+            for question_id, p_value, d in zip(questions, p_values, discrimination)
+        )
+    if not analysis:
+        return 0
+
+    conn.execute(
+        text(
+            "UPDATE question_stats SET p_value = :p_value, discrimination = :discrimination, "
+            "analysis_updated = NOW() WHERE question_id = :question_id"
+        ),
+        analysis,
+    )
+    return len(analysis)
+
+
+def update_leaderboard(
+    conn, course: str, user_ids: list[int], hidden_topics: list[str]
+) -> None:
+    """
+    compute the scores of user_ids in course and save them in the leaderboard
+    in the transaction of conn (the caller must commit)
+
+    the score is the mean of the topic scores (hidden topics excluded),
+    as computed by get_scores; admin (user_id 0), the admin and manager accounts
+    and the managers of the course are not ranked (their rows are removed)
+    """
+    if not user_ids:
+        return
+    parameters = {
+        "course": course,
+        "user_ids": list(user_ids),
+        "hidden_topics": list(hidden_topics or []),
+    }
+    conn.execute(
+        text(
+            f"DELETE FROM leaderboard WHERE course = :course AND user_id IN ({NOT_RANKED_USERS})"
+        ),
+        parameters,
+    )
+    conn.execute(
+        text(
+            f"""
+            WITH topic_questions AS (
+                SELECT id, topic, COUNT(*) OVER (PARTITION BY topic) AS n_questions
+                FROM questions
+                WHERE course = :course AND deleted IS NULL
+                    AND topic <> ALL(CAST(:hidden_topics AS TEXT[]))
+            ),
+            user_scores AS (
+                SELECT
+                    s.user_id,
+                    SUM(CAST(s.n_ok AS FLOAT) / NULLIF(s.n_ok + s.n_no, 0) / q.n_questions) AS total
+                FROM user_question_stats s
+                JOIN topic_questions q ON q.id = s.question_id
+                WHERE s.course = :course AND s.user_id = ANY(:user_ids)
+                GROUP BY s.user_id
+            )
+            INSERT INTO leaderboard (course, user_id, score, updated)
+            SELECT
+                :course,
+                u.user_id,
+                COALESCE(s.total / NULLIF((SELECT COUNT(DISTINCT topic) FROM topic_questions), 0), 0),
+                NOW()
+            FROM unnest(CAST(:user_ids AS INTEGER[])) AS u(user_id)
+            LEFT JOIN user_scores s ON s.user_id = u.user_id
+            WHERE u.user_id NOT IN ({NOT_RANKED_USERS})
+            ON CONFLICT (course, user_id) DO UPDATE SET
+                score = EXCLUDED.score,
+                updated = EXCLUDED.updated
+            """
+        ),
+        parameters,
+    )
+
+
+def rebuild_leaderboard(conn, course: str, hidden_topics: list[str]) -> int:
+    """
+    recompute the leaderboard of course from user_question_stats
+    (after a modification of the questions, of the hidden topics or of the managers)
+    in the transaction of conn (the caller must commit)
+
+    returns the number of ranked users
+    """
+    conn.execute(
+        text("DELETE FROM leaderboard WHERE course = :course"), {"course": course}
+    )
+    user_ids = (
+        conn.execute(
+            text(
+                "SELECT DISTINCT user_id FROM user_question_stats WHERE course = :course"
+            ),
+            {"course": course},
+        )
+        .scalars()
+        .all()
+    )
+    update_leaderboard(conn, course, user_ids, hidden_topics)
+    return conn.execute(
+        text("SELECT COUNT(*) FROM leaderboard WHERE course = :course"),
+        {"course": course},
+    ).scalar()
+
+
+def leaderboard_position(
+    conn, course: str, user_id: int, n_neighbours: int = 5
+) -> dict:
+    """
+    returns the rank and the score of user_id in the leaderboard of course
+    with the n_neighbours users ranked before and after
+    (users are ranked by score then by id)
+    """
+    score = conn.execute(
+        text(
+            "SELECT score FROM leaderboard WHERE course = :course AND user_id = :user_id"
+        ),
+        {"course": course, "user_id": user_id},
+    ).scalar()
+    if score is None:
+        score = 0
+
+    parameters = {
+        "course": course,
+        "user_id": user_id,
+        "score": score,
+        "n_neighbours": n_neighbours,
+    }
+    rank = (
+        conn.execute(
+            text(
+                "SELECT COUNT(*) FROM leaderboard "
+                "WHERE course = :course AND score >= :score "
+                "AND (score > :score OR user_id < :user_id)"
+            ),
+            parameters,
+        ).scalar()
+        + 1
+    )
+    before = conn.execute(
+        text(
+            "SELECT l.user_id, u.nickname, l.score FROM leaderboard l "
+            "JOIN users u ON u.id = l.user_id "
+            "WHERE l.course = :course AND l.score >= :score "
+            "AND (l.score > :score OR l.user_id < :user_id) "
+            "ORDER BY l.score, l.user_id DESC LIMIT :n_neighbours"
+        ),
+        parameters,
+    ).mappings()
+    after = conn.execute(
+        text(
+            "SELECT l.user_id, u.nickname, l.score FROM leaderboard l "
+            "JOIN users u ON u.id = l.user_id "
+            "WHERE l.course = :course AND l.score <= :score "
+            "AND (l.score < :score OR l.user_id > :user_id) "
+            "ORDER BY l.score DESC, l.user_id LIMIT :n_neighbours"
+        ),
+        parameters,
+    ).mappings()
+
+    before = list(reversed([dict(row) for row in before]))
+    after = [dict(row) for row in after]
+    for idx, row in enumerate(before):
+        row["rank"] = rank - len(before) + idx
+    for idx, row in enumerate(after):
+        row["rank"] = rank + 1 + idx
+
+    return {"rank": rank, "score": score, "before": before, "after": after}
+
+
+def rebuild_course_rollups(conn, course: str | None = None) -> None:
+    """
+    recompute course_hourly_stats and course_hourly_users from the results
+    (of course or of all courses) in the transaction of conn (the caller must commit)
+    the rollups are maintained by triggers on results (see migrations/005_course_rollups.sql),
+    the rollups of the archived months (archived_results_stats) are kept
+    """
+    where = "AND course = :course" if course is not None else ""
+    not_archived = (
+        "date_trunc('month', {column}) NOT IN "
+        "(SELECT DISTINCT month FROM archived_results_stats)"
+    )
+    for table in ("course_hourly_stats", "course_hourly_users"):
+        conn.execute(
+            text(
+                f"DELETE FROM {table} WHERE {not_archived.format(column='hour')} {where}"
+            ),
+            {"course": course},
+        )
+    conn.execute(
+        text(
+            "INSERT INTO course_hourly_stats (course, hour, topic, question_type, from_admin, n_answers, n_ok) "
+            "SELECT course, date_trunc('hour', timestamp), topic, question_type, user_id = 0, "
+            "COUNT(*), COUNT(*) FILTER (WHERE good_answer) "
+            "FROM results WHERE course IS NOT NULL "
+            f"AND {not_archived.format(column='timestamp')} {where} "
+            "GROUP BY 1, 2, 3, 4, 5"
+        ),
+        {"course": course},
+    )
+    conn.execute(
+        text(
+            "INSERT INTO course_hourly_users (course, hour, user_id) "
+            "SELECT DISTINCT course, date_trunc('hour', timestamp), user_id "
+            "FROM results WHERE course IS NOT NULL AND user_id <> 0 "
+            f"AND {not_archived.format(column='timestamp')} {where}"
+        ),
+        {"course": course},
+    )
+
+
+def dashboard_stats(conn, course: str) -> dict:
+    """
+    statistics of the answers of course for the dashboard, computed with a single statement
+    on the hourly rollups (GROUPING SETS over course_hourly_stats, FILTER over course_hourly_users)
+
+    the answers of admin are excluded from the counts by day and from the active users
+    """
+    rows = conn.execute(
+        text(
+            """
+            WITH s AS (
+                SELECT
+                    to_char(hour, 'YYYY-MM-DD') AS day,
+                    CAST(EXTRACT(HOUR FROM hour) AS INTEGER) AS hour_of_day,
+                    question_type, topic, from_admin, n_answers, n_ok
+                FROM course_hourly_stats
+                WHERE course = :course
+            ),
+            u AS (
+                SELECT hour, user_id FROM course_hourly_users WHERE course = :course
+            ),
+            active AS (
+                SELECT
+                    COUNT(DISTINCT user_id) FILTER (WHERE hour >= date_trunc('hour', NOW() - INTERVAL '1 hour')) AS last_hour,
+                    COUNT(DISTINCT user_id) FILTER (WHERE hour >= date_trunc('hour', NOW() - INTERVAL '1 day')) AS last_day,
+                    COUNT(DISTINCT user_id) FILTER (WHERE hour >= date_trunc('hour', NOW() - INTERVAL '7 days')) AS last_week,
+                    COUNT(DISTINCT user_id) FILTER (WHERE hour >= date_trunc('hour', NOW() - INTERVAL '30 days')) AS last_month
+                FROM u
+            )
+            SELECT
+                CASE GROUPING(day, hour_of_day, question_type, topic)
+                    WHEN 7 THEN 'day'
+                    WHEN 11 THEN 'hour'
+                    WHEN 13 THEN 'type'
+                    ELSE 'topic'
+                END AS kind,
+                COALESCE(day, CAST(hour_of_day AS TEXT), question_type, topic) AS key,
+                CAST(SUM(n_answers) FILTER (WHERE NOT from_admin) AS INTEGER) AS n_users_answers,
+                CAST(SUM(n_answers) AS INTEGER) AS n_answers,
+                CAST(SUM(n_ok) AS INTEGER) AS n_ok
+            FROM s
+            GROUP BY GROUPING SETS ((day), (hour_of_day), (question_type), (topic))
+            UNION ALL
+            SELECT 'users_by_day', to_char(hour, 'YYYY-MM-DD'), NULL, CAST(COUNT(DISTINCT user_id) AS INTEGER), NULL
+            FROM u
+            GROUP BY 2
+            UNION ALL
+            SELECT 'active', w.key, NULL, CAST(w.n AS INTEGER), NULL
+            FROM active CROSS JOIN LATERAL (
+                VALUES ('last_hour', last_hour), ('last_day', last_day),
+                       ('last_week', last_week), ('last_month', last_month)
+            ) AS w(key, n)
+            """
+        ),
+        {"course": course},
+    ).mappings()
+
+    by_kind: dict = defaultdict(dict)
+    for row in rows:
+        by_kind[row["kind"]][row["key"]] = row
+
+    def accuracy(row) -> float:
+        return round(100 * row["n_ok"] / row["n_answers"], 2)
+
+    return {
+        "by_day": [
+            {
+                "day": day,
+                "n_questions": row["n_users_answers"],
+                "n_users": by_kind["users_by_day"][day]["n_answers"]
+                if day in by_kind["users_by_day"]
+                else 0,
+            }
+            for day, row in sorted(by_kind["day"].items())
+            if row["n_users_answers"]
+        ],
+        "by_hour": [
+            {"hour": int(hour), "count_by_hour": row["n_answers"]}
+            for hour, row in sorted(by_kind["hour"].items(), key=lambda x: int(x[0]))
+        ],
+        "active_users": {
+            key: row["n_answers"] for key, row in by_kind["active"].items()
+        },
+        "accuracy_by_type": dict(
+            sorted(
+                ((key, accuracy(row)) for key, row in by_kind["type"].items()),
+                key=lambda x: x[1],
+            )
+        ),
+        "accuracy_by_topic": {
+            key: accuracy(row) for key, row in sorted(by_kind["topic"].items())
+        },
+    }
@@ -0,0 +1,112 @@
+"""
+per-request SQL instrumentation
+
+for every request: number of statements, total database time and slowest statement
+in debug mode they are sent in the X-SQL-* response headers,
+otherwise they are logged as a JSON line
+
+requests running more than SQL_QUERY_COUNT_WARNING statements (config.py, default 30)
+or the same statement more than SQL_REPEATED_QUERY_WARNING times (default 10)
+are logged as warnings and counted in flagged_endpoints
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+# endpoint -> {"requests": number of flagged requests, "max_queries": ...}
+flagged_endpoints: dict[str, dict] = {}
+flagged_endpoints_lock = threading.Lock()
+
+
+def _one_line(statement: str, max_length: int = 200) -> str:
+    return " ".join(statement.split())[:max_length]
+
+
+def init_app(app, engine) -> None:
+    """
+    register the SQLAlchemy event hooks on engine and the reporting of app
+    """
+
+    query_count_warning = app.config.get("SQL_QUERY_COUNT_WARNING", 30)
+    repeated_query_warning = app.config.get("SQL_REPEATED_QUERY_WARNING", 10)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        if not has_app_context():
+            return
+        stats = g.get("sql_stats")
+        if stats is None:
+            stats = g.sql_stats = {
+                "count": 0,
+                "time": 0.0,
+                "slowest_time": 0.0,
+                "slowest": "",
+                "statements": Counter(),
+            }
+        stats["count"] += 1
+        stats["time"] += elapsed
+        stats["statements"][statement] += 1
+        if elapsed > stats["slowest_time"]:
+            stats["slowest_time"] = elapsed
+            stats["slowest"] = statement
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get(
+            "query_start"
+        ):
+            context.connection.info["query_start"].pop()
+
+    @app.after_request
+    def report_sql_stats(response):
+        stats = g.pop("sql_stats", None)
+        if stats is None:
+            return response
+
+        most_repeated, n_repeated = stats["statements"].most_common(1)[0]
+
+        if app.debug:
+            response.headers["X-SQL-Queries"] = str(stats["count"])
+            response.headers["X-SQL-Time-ms"] = f"{stats['time'] * 1000:.1f}"
+            response.headers["X-SQL-Slowest-ms"] = f"{stats['slowest_time'] * 1000:.1f}"
+        else:
+            logging.info(
+                json.dumps(
+                    {
+                        "event": "sql_stats",
+                        "endpoint": request.endpoint,
+                        "path": request.path,
+                        "status": response.status_code,
+                        "queries": stats["count"],
+                        "db_time_ms": round(stats["time"] * 1000, 1),
+                        "slowest_ms": round(stats["slowest_time"] * 1000, 1),
+                        "slowest": _one_line(stats["slowest"]),
+                    }
+                )
+            )
+
+        if stats["count"] > query_count_warning or n_repeated > repeated_query_warning:
+            logging.warning(
+                f"{request.endpoint}: {stats['count']} queries "
+                f"({n_repeated} x {_one_line(most_repeated, 100)!r})"
+            )
+            with flagged_endpoints_lock:
+                flagged = flagged_endpoints.setdefault(
+                    request.endpoint, {"requests": 0, "max_queries": 0}
+                )
+                flagged["requests"] += 1
+                flagged["max_queries"] = max(flagged["max_queries"], stats["count"])
+                flagged["most_repeated"] = _one_line(most_repeated)
+
+        return response